@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+def copy_fields(model):
+    pk = model._meta.pk
+    return [field for field in model._meta.concrete_fields if field is not pk]
+
+def copy_rows(model, objs):
+    """
+    Database-ready rows for every concrete column of model except the
+    auto-generated primary key, in the order of copy_fields.
+    """
+    fields = copy_fields(model)
+    for obj in objs:
+        # Picks up the ids of related objects saved after obj was built,
+        # as bulk_create does
+        obj._prepare_related_fields_for_save(operation_name='bulk_insert')
+        yield tuple(
+            field.get_db_prep_save(field.pre_save(obj, True), connection)
+            for field in fields
+        )
+
+def copy_insert(model, objs):
+    """
+    Stream objs into the model's table with COPY FROM STDIN. PostgreSQL only;
+    primary keys are not set on the objects.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in copy_fields(model))
+    with transaction.atomic(), connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+            for row in copy_rows(model, objs):
+                copy.write_row(row)
+
+def bulk_insert(model, objs, use_copy=None, batch_size=5000):
+    """
+    Insert objs whose primary keys are not needed afterwards. With use_copy
+    (BULK_LOAD_COPY by default) rows go through COPY on PostgreSQL; other
+    backends always use bulk_create.
+    """
+    if use_copy is None:
+        use_copy = settings.BULK_LOAD_COPY
+    if not objs:
+        return
+    if use_copy and connection.vendor == 'postgresql':
+        copy_insert(model, objs)
+    else:
+        model.objects.bulk_create(objs, batch_size=batch_size)
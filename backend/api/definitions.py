@@ -0,0 +1,221 @@
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import transaction
+from .models import Word, Definition, Translation
+from .translators import get_translator
+
+# Seconds a queued fill keeps its words from being queued again
+IN_FLIGHT_TIMEOUT = 15 * 60
+
+# Cached global definitions; bump the version when what is cached changes
+DEFINITION_CACHE_VERSION = 1
+DEFINITION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Words known to have a filled global definition; definitions are never
+# emptied again, so this only grows
+_defined_ids = set()
+
+def normalize_text(text):
+    return text.strip().lower()
+
+def cached_translations(language_id, texts, batch_size=1000):
+    """
+    Translation cache entries for normalized texts of one language, as a
+    dict of text -> translation holding only the texts already translated.
+    """
+    texts = list(texts)
+    translations = {}
+    for i in range(0, len(texts), batch_size):
+        translations.update(
+            Translation.objects
+            .filter(language_id=language_id, text__in=texts[i:i + batch_size])
+            .values_list('text', 'translation')
+        )
+    return translations
+
+def translate_words(words, translator):
+    """
+    Translation of every (word_id, language_id, text) in words, keyed by word
+    id. Each normalized spelling is looked up in the translation cache and
+    only spellings missing from it are translated, once each, in one batch.
+    Words whose translation failed are left out.
+    """
+    texts_by_language = defaultdict(set)
+    for _, language_id, text in words:
+        texts_by_language[language_id].add(normalize_text(text))
+
+    translations = {}
+    for language_id, texts in texts_by_language.items():
+        cached = cached_translations(language_id, texts)
+        missing = sorted(texts - cached.keys())
+        if missing:
+            new_translations = []
+            for text, translated_word in zip(missing, translator.translate_batch(missing)):
+                if translated_word is None:
+                    continue
+                cached[text] = translated_word
+                new_translations.append(Translation(language_id=language_id, text=text, translation=translated_word))
+            Translation.objects.bulk_create(new_translations, batch_size=1000, ignore_conflicts=True)
+        for text, translated_word in cached.items():
+            translations[(language_id, text)] = translated_word
+
+    return {
+        word_id: translations[(language_id, normalize_text(text))]
+        for word_id, language_id, text in words
+        if (language_id, normalize_text(text)) in translations
+    }
+
+def fill_definitions(word_ids, source, translator=None):
+    """
+    Fill the global definition of every given word that has none yet, from
+    the translation cache or else the translator (the configured backend,
+    translating from source, by default). Global Definition rows are only
+    created here, when there is text to put in them; empty placeholders left
+    by older imports are filled in place. Returns the ids of the words filled.
+    """
+    filled_ids = set(
+        Definition.objects
+        .filter(word_id__in=word_ids, user=None, text__isnull=False)
+        .values_list('word_id', flat=True)
+    )
+    words = list(
+        Word.objects
+        .filter(id__in=word_ids)
+        .exclude(id__in=filled_ids)
+        .values_list('id', 'language_id', 'text')
+    )
+    if not words:
+        return []
+
+    if translator is None:
+        translator = get_translator(source)
+    translations = translate_words(words, translator)
+
+    placeholders = defaultdict(list)
+    for definition in Definition.objects.filter(word_id__in=translations.keys(), user=None, text=None):
+        placeholders[definition.word_id].append(definition)
+
+    updated = []
+    created = []
+    for word_id, text in translations.items():
+        if word_id in placeholders:
+            for definition in placeholders[word_id]:
+                definition.text = text
+                updated.append(definition)
+        else:
+            created.append(Definition(user=None, word_id=word_id, text=text))
+
+    with transaction.atomic():
+        Definition.objects.bulk_update(updated, ['text'], batch_size=1000)
+        Definition.objects.bulk_create(created, batch_size=1000)
+    _defined_ids.update(translations.keys())
+    invalidate_global_definitions(translations.keys())
+    return list(translations.keys())
+
+def in_flight_key(word_id):
+    return f'definition_in_flight:{word_id}'
+
+def undefined_word_ids(word_ids):
+    """
+    The given word ids without a filled global definition. Ids already known
+    to be defined are skipped without a query; the rest are checked with one.
+    """
+    unknown = [word_id for word_id in word_ids if word_id not in _defined_ids]
+    if not unknown:
+        return []
+    defined = set(
+        Definition.objects
+        .filter(word_id__in=unknown, user=None, text__isnull=False)
+        .values_list('word_id', flat=True)
+    )
+    _defined_ids.update(defined)
+    return [word_id for word_id in unknown if word_id not in defined]
+
+def claim_word_ids(word_ids):
+    """
+    Mark word ids as having a fill queued and return those that were not
+    already marked. Each mark is added atomically, so concurrent requests
+    never claim the same word twice. Marks are cleared when the fill runs,
+    or expire.
+    """
+    return [
+        word_id for word_id in word_ids
+        if cache.add(in_flight_key(word_id), True, IN_FLIGHT_TIMEOUT)
+    ]
+
+def release_word_ids(word_ids):
+    cache.delete_many([in_flight_key(word_id) for word_id in word_ids])
+
+def definition_key(word_id):
+    return f'definition:{word_id}'
+
+def invalidate_global_definitions(word_ids):
+    cache.delete_many([definition_key(word_id) for word_id in word_ids], version=DEFINITION_CACHE_VERSION)
+
+def load_global_definitions(word_ids):
+    """
+    Global definition text per word id from the database. Words whose
+    definition has not been filled yet fall back to the translation cache for
+    their spelling; words in neither are left out.
+    """
+    definitions = dict(
+        Definition.objects
+        .filter(word_id__in=word_ids, user=None, text__isnull=False)
+        .values_list('word_id', 'text')
+    )
+    missing = set(word_ids) - definitions.keys()
+    if not missing:
+        return definitions
+
+    words_by_language = defaultdict(list)
+    for word_id, language_id, text in Word.objects.filter(id__in=missing).values_list('id', 'language_id', 'text'):
+        words_by_language[language_id].append((word_id, normalize_text(text)))
+
+    for language_id, words in words_by_language.items():
+        cached = cached_translations(language_id, {text for _, text in words})
+        for word_id, text in words:
+            if text in cached:
+                definitions[word_id] = cached[text]
+    return definitions
+
+def get_global_definitions(word_ids):
+    """
+    Global definition text per word id, read from the cache with one
+    multi-get and loaded from the database only for words not cached yet.
+    Words without a definition are left out and not cached, so they are
+    picked up as soon as they are filled.
+    """
+    keys = {definition_key(word_id): word_id for word_id in set(word_ids)}
+    cached = cache.get_many(keys.keys(), version=DEFINITION_CACHE_VERSION)
+    definitions = {keys[key]: text for key, text in cached.items()}
+
+    missing = [word_id for word_id in keys.values() if word_id not in definitions]
+    if missing:
+        loaded = load_global_definitions(missing)
+        cache.set_many(
+            {definition_key(word_id): text for word_id, text in loaded.items()},
+            DEFINITION_CACHE_TIMEOUT, version=DEFINITION_CACHE_VERSION
+        )
+        definitions.update(loaded)
+    return definitions
+
+def get_user_definitions(user, word_ids):
+    """
+    The user's own definitions per word id, overriding the global ones.
+    """
+    if user is None or not user.is_authenticated:
+        return {}
+    return dict(
+        Definition.objects
+        .filter(user=user, word_id__in=word_ids)
+        .values_list('word_id', 'text')
+    )
+
+def resolve_definitions(user, word_ids):
+    """
+    Definition text per word id as a user sees it: their own definition if
+    they wrote one, else the global one. Words with neither are left out.
+    """
+    definitions = get_global_definitions(word_ids)
+    definitions.update(get_user_definitions(user, word_ids))
+    return definitions
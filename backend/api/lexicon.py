@@ -0,0 +1,239 @@
+import time
+from collections import namedtuple
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from .models import Word
+
+VERSION_CACHE_KEY = 'word_root_index_version'
+
+Candidate = namedtuple('Candidate', ['id', 'tag', 'root_id'])
+
+_index = None
+_index_key = None
+_checked_at = 0.0
+
+class WordRootIndex:
+    """
+    In-memory word -> root lookup over the whole lexicon: a dense array
+    indexed by Word.id holding each word's root id (a root maps to itself,
+    missing ids to -1), plus a CSR of root id -> derived word ids.
+    """
+
+    def __init__(self, word_ids, root_ids):
+        size = int(word_ids.max()) + 1 if len(word_ids) else 1
+        dtype = np.int32 if size < np.iinfo(np.int32).max else np.int64
+
+        self.roots = np.full(size, -1, dtype=dtype)
+        self.roots[word_ids] = root_ids
+
+        is_derived = word_ids != root_ids
+        derived_ids = word_ids[is_derived]
+        derived_roots = root_ids[is_derived]
+        order = np.argsort(derived_roots, kind='stable')
+        self.derived = derived_ids[order].astype(dtype)
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(derived_roots, minlength=size), out=self.indptr[1:])
+
+    @classmethod
+    def from_database(cls, chunk_size=200000):
+        word_ids = []
+        root_ids = []
+        rows = (
+            Word.objects
+            .annotate(root_word_id=Coalesce('root_id', 'id'))
+            .values_list('id', 'root_word_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                data = np.array(chunk, dtype=np.int64)
+                word_ids.append(data[:, 0])
+                root_ids.append(data[:, 1])
+                chunk = []
+        if chunk:
+            data = np.array(chunk, dtype=np.int64)
+            word_ids.append(data[:, 0])
+            root_ids.append(data[:, 1])
+
+        if not word_ids:
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        return cls(np.concatenate(word_ids), np.concatenate(root_ids))
+
+    def root_of(self, word_ids):
+        """
+        Root id for every word id (the id itself for root words, -1 for ids
+        that are not in the lexicon).
+        """
+        word_ids = np.asarray(list(word_ids), dtype=np.int64)
+        roots = np.full(len(word_ids), -1, dtype=np.int64)
+        in_range = (word_ids >= 0) & (word_ids < len(self.roots))
+        roots[in_range] = self.roots[word_ids[in_range]]
+        return roots
+
+    def derived_of(self, root_ids):
+        """
+        Ids of every word derived from the given root ids.
+        """
+        root_ids = np.asarray(list(root_ids), dtype=np.int64)
+        root_ids = root_ids[(root_ids >= 0) & (root_ids < len(self.roots))]
+        starts = self.indptr[root_ids]
+        counts = self.indptr[root_ids + 1] - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.derived[positions].astype(np.int64)
+
+    def expand(self, word_ids):
+        """
+        The given word ids together with every word derived from them.
+        """
+        word_ids = np.asarray(list(word_ids), dtype=np.int64)
+        return np.union1d(word_ids, self.derived_of(word_ids))
+
+def _current_key():
+    max_id = Word.objects.aggregate(max_id=Max('id'))['max_id']
+    return (max_id, cache.get(VERSION_CACHE_KEY, 0))
+
+def get_word_index():
+    """
+    Return the process-wide word root index, loading it on first use. Every
+    WORD_INDEX_CHECK_SECONDS the index is rebuilt if words were added or the
+    lexicon was invalidated since it was loaded.
+    """
+    global _index, _index_key, _checked_at
+
+    if _index is not None and time.monotonic() - _checked_at < settings.WORD_INDEX_CHECK_SECONDS:
+        return _index
+
+    key = _current_key()
+    if _index is None or key != _index_key:
+        _index = WordRootIndex.from_database()
+        _index_key = key
+    _checked_at = time.monotonic()
+    return _index
+
+def invalidate_word_index():
+    # Bump the version so other processes reload on their next check; this
+    # only reaches them when CACHES is shared (not the default local memory)
+    global _index, _index_key
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+    _index = None
+    _index_key = None
+
+def resolve_root_ids(word_ids):
+    """
+    Root id for every word id like WordRootIndex.root_of, falling back to the
+    database for words added since the index was loaded.
+    """
+    word_ids = np.asarray(list(word_ids), dtype=np.int64)
+    root_ids = get_word_index().root_of(word_ids)
+    missing = root_ids == -1
+    if missing.any():
+        root_map = dict(
+            Word.objects
+            .filter(id__in=word_ids[missing].tolist())
+            .annotate(root_word_id=Coalesce('root_id', 'id'))
+            .values_list('id', 'root_word_id')
+        )
+        root_ids[missing] = [root_map.get(word_id, -1) for word_id in word_ids[missing].tolist()]
+    return root_ids
+
+def best_match(stanza_pos, datawords):
+    target_parts = stanza_pos.split(":")
+    target_first = target_parts[0]
+
+    def count_matching_components(word):
+        if not word.tag:
+            return -1
+
+        word_parts = word.tag.split(":")
+        
+        # Ensure the first component matches
+        if word_parts[0] != target_first:
+            return -1
+        
+        # Count matching elements
+        return sum(1 for part in word_parts if part in target_parts)
+
+    # Filter valid candidates (must start with the same first component)
+    valid_candidates = [word for word in datawords if word.tag and word.tag.startswith(target_first)]
+
+    # Find the best match (max matching components)
+    best_match = max(valid_candidates, key=count_matching_components, default=None)
+
+    return best_match
+
+class ImportLexicon:
+    """
+    Word candidates by text for one language, fetched in batches and kept for
+    the duration of an import, with token resolution memoized per
+    (text, upos) so repeated tokens cost nothing.
+    """
+
+    def __init__(self, language, batch_size=1000):
+        self.language = language
+        self.batch_size = batch_size
+        self.candidates = {}
+        self.resolved = {}
+
+    def prefetch(self, texts):
+        missing = [text for text in set(texts) if text not in self.candidates]
+        for text in missing:
+            self.candidates[text] = []
+
+        for i in range(0, len(missing), self.batch_size):
+            rows = (
+                Word.objects
+                .filter(language=self.language, text__in=missing[i:i + self.batch_size])
+                .order_by('id')
+                .values_list('text', 'id', 'tag', 'root_id')
+            )
+            for text, word_id, tag, root_id in rows:
+                self.candidates[text].append(Candidate(word_id, tag, root_id))
+
+    def get(self, text):
+        if text not in self.candidates:
+            self.prefetch([text])
+        return self.candidates[text]
+
+    def resolve(self, text, stanza_pos):
+        """
+        Id of the word a spoken token most likely is, or None if the token is
+        not in the lexicon.
+        """
+        key = (text, stanza_pos)
+        if key not in self.resolved:
+            self.resolved[key] = self._resolve(text, stanza_pos)
+        return self.resolved[key]
+
+    def _resolve(self, text, stanza_pos):
+        candidates = self.get(text)
+        if not candidates:
+            return None
+
+        # edge cases
+        if text in ('też', 'mieć'):
+            return next((c.id for c in candidates if c.root_id is None), None)
+        elif text == 'mam':
+            return next((c.id for c in candidates if c.tag == 'fin:sg:pri:imperf'), None)
+        elif text == 'mają':
+            roots = {c.id for c in self.get('mieć')}
+            return next((c.id for c in candidates if c.root_id in roots), None)
+
+        if len(candidates) == 1:
+            return candidates[0].id
+
+        dataword = next((c for c in candidates if c.tag and c.tag == stanza_pos), None)
+        if dataword:
+            return dataword.id
+
+        dataword = best_match(stanza_pos, candidates)
+        if dataword:
+            return dataword.id
+        return candidates[0].id
@@ -0,0 +1,225 @@
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment
+)
+from rest_framework.test import APIRequestFactory, force_authenticate
+from api.models import (
+    Language, Word, Channel, Video, WordInstance, VideoWordCount, UserWord,
+    UserPreferences
+)
+from api.scoring import invalidate_score_matrix, get_score_matrix
+from api.lexicon import invalidate_word_index
+from api.definitions import fill_definitions
+from api.translators import StubTranslator
+from api.tasks import calculate_user_video_scores
+from api.utils import (
+    build_video_word_counts, generate_video_score_list, populate_user_video_scores,
+    propagate_video_scores, user_id_ranges
+)
+from api.views import get_videos
+
+def generate_corpus(roots, forms, videos, instances, users, vocab, zipf, seed):
+    """
+    Fill the database with a synthetic lexicon of root words and derived
+    forms, videos whose word instances follow a Zipf distribution, and users
+    whose vocabularies lean towards the most frequent roots.
+    """
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+
+    language = Language.objects.create(name='Benchmark', abb='xx')
+    channel = Channel.objects.create(url='benchmark', name='benchmark')
+
+    root_words = Word.objects.bulk_create([
+        Word(text=f'r{i}', language=language, tag='subst:sg:nom')
+        for i in range(roots)
+    ], batch_size=5000)
+    derived_words = Word.objects.bulk_create([
+        Word(text=f'r{i}f{j}', language=language, tag='subst:pl:gen', root=root)
+        for i, root in enumerate(root_words) for j in range(forms)
+    ], batch_size=5000)
+    all_words = root_words + derived_words
+
+    # Frequency ranks are shuffled so common words are spread over roots and forms
+    ranked_words = list(all_words)
+    random.shuffle(ranked_words)
+    weights = 1.0 / np.arange(1, len(ranked_words) + 1) ** zipf
+    weights /= weights.sum()
+
+    video_objects = [
+        Video(url=f'benchmark{i}', title=f'Benchmark {i}', channel=channel, language=language)
+        for i in range(videos)
+    ]
+    word_instances = []
+    for video in video_objects:
+        count = max(1, int(rng.poisson(instances)))
+        for position, rank in enumerate(rng.choice(len(ranked_words), size=count, p=weights)):
+            word_instances.append(WordInstance(word=ranked_words[rank], video=video, start=position, end=position + 1))
+
+    word_counts = build_video_word_counts(word_instances)
+    Video.objects.bulk_create(video_objects, batch_size=1000)
+    WordInstance.objects.bulk_create(word_instances, batch_size=5000)
+    VideoWordCount.objects.bulk_create(word_counts, batch_size=5000)
+
+    position = {word.pk: rank for rank, word in enumerate(ranked_words)}
+    root_rank = sorted(root_words, key=lambda word: position[word.pk])
+    user_objects = []
+    for i in range(users):
+        user = User.objects.create(username=f'benchmark{i}')
+        UserPreferences.objects.create(user=user, language=language)
+        size = min(vocab, roots)
+        common = root_rank[:size // 2]
+        rest = random.sample(root_words, size - len(common))
+        UserWord.objects.bulk_create(
+            [UserWord(user=user, word=word) for word in set(common + rest)],
+            batch_size=5000
+        )
+        user_objects.append(user)
+
+    invalidate_word_index()
+    invalidate_score_matrix()
+    return language, user_objects, all_words
+
+class Command(BaseCommand):
+    help = "Benchmarks video scoring and ranking against a synthetic corpus in a throwaway database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roots', type=int, default=2000, help='Number of root words')
+        parser.add_argument('--forms', type=int, default=5, help='Derived forms per root word')
+        parser.add_argument('--videos', type=int, default=200)
+        parser.add_argument('--instances', type=int, default=1500, help='Mean word instances per video')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--vocab', type=int, default=500, help='Root words known per user')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of word frequencies')
+        parser.add_argument('--definitions', type=int, default=2000, help='Words whose definitions are filled')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=str, default=None, help='Write JSON results to this file')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        # Lets APIRequestFactory's 'testserver' host through ALLOWED_HOSTS
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        self.results = []
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            # Report whatever stages finished, even if a later one failed
+            self.report(options)
+
+    def report(self, options):
+        report = {
+            'commit': self.commit(),
+            'config': {key: options[key] for key in (
+                'roots', 'forms', 'videos', 'instances', 'users', 'vocab', 'zipf', 'definitions', 'seed'
+            )},
+            'results': self.results,
+        }
+
+        for result in self.results:
+            self.stdout.write(
+                f"{result['stage']:<36} {result['seconds']:>9.4f}s "
+                f"{result['queries']:>7} queries {result['peak_memory_bytes'] / 1e6:>9.2f} MB"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run(self, options):
+        language, users, all_words = self.measure('generate_corpus', generate_corpus,
+            options['roots'], options['forms'], options['videos'], options['instances'],
+            options['users'], options['vocab'], options['zipf'], options['seed'])
+
+        self.measure('build_score_matrix', get_score_matrix)
+
+        vocabularies = [
+            set(UserWord.objects.filter(user=user).values_list('word_id', flat=True))
+            for user in users
+        ]
+        self.measure('generate_video_score_list', lambda: [
+            generate_video_score_list(word_ids) for word_ids in vocabularies
+        ])
+
+        self.measure('calculate_user_video_scores', lambda: [
+            calculate_user_video_scores.now(user.id, language.id) for user in users
+        ])
+
+        # Small vocabulary edits on top of an already scored word set
+        rng = random.Random(options['seed'])
+        for user in users:
+            UserWord.objects.bulk_create(
+                [UserWord(user=user, word=word) for word in rng.sample(all_words, 10)],
+                ignore_conflicts=True
+            )
+        self.measure('calculate_user_video_scores_delta', lambda: [
+            calculate_user_video_scores.now(user.id, language.id) for user in users
+        ])
+
+        preferences = list(UserPreferences.objects.filter(user__in=users).select_related('word_set'))
+        self.measure('populate_user_video_scores', lambda: [
+            populate_user_video_scores(prefs.user_id, language.id, prefs.word_set) for prefs in preferences
+        ])
+
+        video_ids = list(Video.objects.values_list('id', flat=True))
+        self.measure('propagate_video_scores', lambda: [
+            propagate_video_scores(video_ids, min_user_id, max_user_id)
+            for min_user_id, max_user_id in user_id_ranges(1000)
+        ])
+
+        factory = APIRequestFactory()
+
+        def rank_videos():
+            for user in users:
+                for page in (1, 2, 3):
+                    request = factory.get('/api/videos/', {'page': page})
+                    force_authenticate(request, user=user)
+                    get_videos(request)
+
+        self.measure('get_videos', rank_videos)
+
+        # Offline translator, so only the cache lookups and writes are timed
+        word_ids = [word.id for word in all_words[:options['definitions']]]
+        self.measure('fill_definitions', fill_definitions,
+            word_ids, language.abb, StubTranslator(language.abb))
+        return self.results
+
+    def measure(self, stage, func, *args):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            value = func(*args)
+            seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.results.append({
+            'stage': stage,
+            'seconds': seconds,
+            'queries': len(queries),
+            'peak_memory_bytes': peak,
+        })
+        return value
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+# python manage.py benchmark --videos 500 --users 50 --output bench.json
@@ -0,0 +1,178 @@
+import multiprocessing
+import time
+from functools import partial
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from api.models import Channel, Video, Sentence, WordInstance, Language
+from api.lexicon import ImportLexicon
+from api.transcripts import DirectoryTranscriptFetcher, TranscriptUnavailable
+from .ytimport import (
+    get_pipeline, tag_transcripts, transcript_word_instances, extract_sentences, save_videos,
+    update_wordset_scores_for_new_videos, update_user_video_scores_for_new_videos
+)
+
+_lexicon = None
+
+def init_worker(language_id):
+    # Every worker keeps its own Stanza pipeline and lexicon for its lifetime
+    global _lexicon
+    _lexicon = ImportLexicon(language_id)
+    get_pipeline()
+
+def process_transcripts(directory, video_ids):
+    """
+    Tag and resolve a group of transcript files with a single Stanza call.
+    Returns plain picklable rows for the writer: per video its title, the
+    (text, start, end) of its sentences, the (word_id, start, end) of its
+    word instances and the number of tokens tagged.
+    """
+    fetcher = DirectoryTranscriptFetcher(directory)
+    loaded = []
+    for video_id in video_ids:
+        try:
+            data = fetcher.load(video_id)
+        except TranscriptUnavailable:
+            continue
+        loaded.append((video_id, str(data.get('title', video_id)), data.get('transcript') or []))
+
+    tagged = tag_transcripts([transcript for _, _, transcript in loaded])
+    _lexicon.prefetch(
+        token.lower()
+        for transcript_pos in tagged for segment in transcript_pos for token, _ in segment
+    )
+
+    results = []
+    for (video_id, title, transcript), transcript_pos in zip(loaded, tagged):
+        results.append({
+            'url': video_id,
+            'title': title,
+            'sentences': [
+                (sentence.text, sentence.start, sentence.end)
+                for sentence in extract_sentences(transcript, None)
+            ],
+            'instances': transcript_word_instances(transcript, transcript_pos, _lexicon),
+            'tokens': sum(len(segment) for segment in transcript_pos),
+        })
+    return results
+
+class Command(BaseCommand):
+    help = "Imports a directory of transcript dumps (<video id>.json) using several tagging processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=str)
+        parser.add_argument('channel_url', type=str)
+        parser.add_argument('language', type=str)
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Tagging processes, each with its own Stanza pipeline')
+        parser.add_argument('--files-per-task', type=int, default=8,
+                            help='Transcripts tagged together in one Stanza call')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Videos written per database flush')
+        parser.add_argument('--user-chunk-size', type=int, default=5000,
+                            help='Number of user ids per score propagation statement')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue score propagation as background tasks')
+        parser.add_argument('--copy', action='store_true',
+                            help='Load sentences and word instances with COPY (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        language = str(options['language'])
+        if language != 'pl':
+            raise CommandError("Only Polish transcripts can be tagged.")
+        try:
+            language_object = Language.objects.get(abb=language)
+        except Language.DoesNotExist:
+            raise CommandError(f"Language '{language}' does not exist.")
+
+        channel_url = str(options['channel_url'])
+        channel, _ = Channel.objects.get_or_create(
+            url=channel_url,
+            name=channel_url.split("@")[-1]
+        )
+
+        directory = options['directory']
+        existing_urls = set(Video.objects.values_list('url', flat=True))
+        video_ids = [
+            video_id for video_id in DirectoryTranscriptFetcher(directory).video_ids()
+            if video_id not in existing_urls
+        ]
+        size = max(1, options['files_per_task'])
+        tasks = [video_ids[i:i + size] for i in range(0, len(video_ids), size)]
+        processes = max(1, min(options['processes'], len(tasks)))
+        self.stdout.write(f"Ingesting {len(video_ids)} transcripts with {processes} process(es)...")
+
+        self.channel = channel
+        self.language = language_object
+        self.new_videos = []
+        self.video_count = 0
+        self.token_count = 0
+        self.use_copy = options['copy'] or None
+        self.started = time.perf_counter()
+
+        worker = partial(process_transcripts, directory)
+        pending = []
+        if processes == 1:
+            init_worker(language_object.id)
+            for results in map(worker, tasks):
+                pending.extend(results)
+                if len(pending) >= options['batch_size']:
+                    self.write(pending)
+                    pending = []
+        else:
+            # Workers open their own database connections after the fork
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(
+                processes, initializer=init_worker, initargs=(language_object.id,)
+            ) as pool:
+                # This process is the only writer, so flushes never contend
+                for results in pool.imap_unordered(worker, tasks):
+                    pending.extend(results)
+                    if len(pending) >= options['batch_size']:
+                        self.write(pending)
+                        pending = []
+        if pending:
+            self.write(pending)
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.video_count} videos and {self.token_count} tokens in {elapsed:.1f}s "
+            f"({self.video_count / elapsed if elapsed else 0:.2f} videos/s, "
+            f"{self.token_count / elapsed if elapsed else 0:.0f} tokens/s)."
+        ))
+
+        update_wordset_scores_for_new_videos(self.new_videos)
+        if not settings.VIDEO_SCORES_READ_THROUGH:
+            update_user_video_scores_for_new_videos(
+                self.new_videos, options['user_chunk_size'], options['background']
+            )
+
+    def write(self, results):
+        videos = []
+        sentences = []
+        wordinstances = []
+        for result in results:
+            vid = Video(url=result['url'], title=result['title'], channel=self.channel,
+                        language=self.language, auto_generated=True)
+            videos.append(vid)
+            sentences.extend(
+                Sentence(video=vid, text=text, start=start, end=end)
+                for text, start, end in result['sentences']
+            )
+            wordinstances.extend(
+                WordInstance(word_id=word_id, video=vid, start=start, end=end)
+                for word_id, start, end in result['instances']
+            )
+            self.token_count += result['tokens']
+
+        save_videos(videos, sentences, wordinstances, self.use_copy)
+
+        self.new_videos.extend(videos)
+        self.video_count += len(videos)
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            f"{self.video_count} videos, {self.token_count} tokens "
+            f"({self.video_count / elapsed:.2f} videos/s, {self.token_count / elapsed:.0f} tokens/s)"
+        )
+
+# python manage.py bulkingest data/transcripts "https://www.youtube.com/@EasyPolish" pl --processes 4
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from api.models import Video
+from api.scoring import rebuild_video_word_counts
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-video root word counts from WordInstances."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        video_ids = list(Video.objects.order_by('id').values_list('id', flat=True))
+
+        for i in range(0, len(video_ids), batch_size):
+            rebuild_video_word_counts(video_ids[i:i + batch_size])
+            self.stdout.write(f"Counted {min(i + batch_size, len(video_ids))}/{len(video_ids)} videos")
+
+        self.stdout.write(self.style.SUCCESS("All video word counts rebuilt."))
+
+# python manage.py countvideowords
@@ -1,14 +1,52 @@
 import json
+import multiprocessing
 import os
+from django.db import transaction
 from api.models import Word, Language
+from api.lexicon import invalidate_word_index
 
 from django.core.management.base import BaseCommand, CommandError
 
+def parse_entry(line):
+    """
+    Parse one .jsonl line into (text, tag, ipa, forms) for the lemma, with
+    forms a list of (text, tag) pairs without exact duplicates. Returns None
+    for blank lines.
+    """
+    if not line.strip():
+        return None
+    obj = json.loads(line)
+
+    pos = obj.get('pos')
+    text = obj.get('word')
+    forms = obj.get('forms', [])
+    ipa = obj.get('ipa', None)
+
+    # infinitive verbs
+    tag = 'inf' if forms and pos == 'verb' and text.endswith('n') else None
+
+    # conjugations / declensions
+    form_list = []
+    seen = set()
+    for form in forms:
+        parts = form['form'].split()
+        if not parts:
+            continue
+        form_key = (parts[-1], ':'.join(form.get('tags', [])))
+        if form_key not in seen:
+            seen.add(form_key)
+            form_list.append(form_key)
+    return text, tag, ipa, form_list
+
 class Command(BaseCommand):
     help = 'Imports german linguistic data'
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='Path to de-extract.jsonl')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Lemmas bulk inserted together, followed by their forms')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Processes parsing JSON lines in parallel')
 
     def handle(self, *args, **options):
         file_path = options['file_path']
@@ -17,9 +55,9 @@ class Command(BaseCommand):
             raise CommandError(f"File not found: {file_path}")
         if not file_path.endswith('.jsonl'):
             raise CommandError("Input file must be a .jsonl file.")
-        
-        words = []
-        batchsize = 10000
+
+        batch_size = options['batch_size']
+        processes = options['processes']
 
         lang = "de"
         langname = "German"
@@ -27,44 +65,52 @@ class Command(BaseCommand):
             name=langname, abb=lang
         )
 
+        entries = []
+        lemma_count = 0
+        form_count = 0
         with open(file_path, 'r', encoding='utf-8') as f_in:
-            for line in f_in:
-                if len(words) > batchsize:                        
-                    Word.objects.bulk_create(words)
-                    words.clear()
-                obj = json.loads(line)
-
-                pos = obj.get('pos')
-                text = obj.get('word')
-                forms = obj.get('forms', [])
-                ipa = obj.get('ipa', None)
-
-                # infinitive verbs
-                if forms and pos == 'verb' and text.endswith('n'):
-                    inf_word = Word(text=text, language=de, tag='inf', wtype=None, abb=None, root=None, ipa=ipa)
-                    inf_word.save()
-                    # conjugations
-                    for form in forms:
-                        form_text = form['form'].split()[-1]
-                        tags = ':'.join(form.get('tags', []))
-                        form_word = Word(text=form_text, language=de, tag=tags, wtype=None, abb=None, root=inf_word, ipa=None)
-                        words.append(form_word)
-
-                else:
-                    root_word = Word(text=text, language=de, tag=None, wtype=None, abb=None, root=None, ipa=ipa)
-                    root_word.save()
-                    for form in forms:
-                        form_text = form['form'].split()[-1]
-                        tags = ':'.join(form.get('tags', []))
-                        form_word = Word(text=form_text, language=de, tag=tags, wtype=None, abb=None, root=root_word, ipa=None)
-                        words.append(form_word)
-
-        if words:
-            Word.objects.bulk_create(words)
-
+            if processes > 1:
+                pool = multiprocessing.get_context('fork').Pool(processes)
+                parsed = pool.imap(parse_entry, f_in, chunksize=1000)
+            else:
+                pool = None
+                parsed = map(parse_entry, f_in)
+            try:
+                for entry in parsed:
+                    if entry is None:
+                        continue
+                    entries.append(entry)
+                    if len(entries) >= batch_size:
+                        form_count += self.write(entries, de)
+                        lemma_count += len(entries)
+                        entries = []
+                        self.stdout.write(f"{lemma_count} lemmas, {form_count} forms")
+            finally:
+                if pool is not None:
+                    pool.terminate()
+        if entries:
+            form_count += self.write(entries, de)
+            lemma_count += len(entries)
 
+        invalidate_word_index()
+        self.stdout.write(self.style.SUCCESS(f"Imported {lemma_count} lemmas, {form_count} forms."))
 
+    def write(self, entries, language):
+        # Lemmas first so their ids can be assigned to the forms
+        with transaction.atomic():
+            roots = Word.objects.bulk_create([
+                Word(text=text, language=language, tag=tag, wtype=None, abb=None, root=None, ipa=ipa)
+                for text, tag, ipa, _ in entries
+            ])
+            forms = [
+                Word(text=form_text, language=language, tag=tags, wtype=None, abb=None, root=root, ipa=None)
+                for root, (_, _, _, form_list) in zip(roots, entries)
+                for form_text, tags in form_list
+            ]
+            Word.objects.bulk_create(forms, batch_size=10000)
+        return len(forms)
 
 '''
 poetry run python manage.py de_import "data/de_cleaned.jsonl"
+poetry run python manage.py de_import "data/de_cleaned.jsonl" --processes 4
 '''
\ No newline at end of file
@@ -0,0 +1,9 @@
+from .pl_ipa import Command as IpaCommand
+
+class Command(IpaCommand):
+    help = 'Update IPA values for German words from de_words_ipa.tsv'
+
+    default_path = "data/de_words_ipa.tsv"
+    default_language = "German"
+
+# python manage.py de_ipa
@@ -1,23 +1,40 @@
 from django.core.management.base import BaseCommand
-from api.models import Word, Definition
+from api.models import Definition, Translation
+from api.definitions import normalize_text
 
 class Command(BaseCommand):
-    help = 'Add Definitions to Table'
+    help = 'Seed the translation cache from filled global definitions and remove empty placeholders'
 
     def handle(self, *args, **options):
         batchsize = 5000
-        definitions = []
+        translations = []
+        seen = set()
 
-        words = Word.objects.all().iterator()
+        # Global definitions are created when they are filled, so the empty
+        # rows this command used to create for every word are not needed
+        deleted, _ = Definition.objects.filter(user=None, text=None).delete()
 
-        for word in words:
-            definition = Definition(user=None, word=word, text=None)
-            definitions.append(definition)
-            if len(definitions) > batchsize:
-                Definition.objects.bulk_create(definitions)
-                definitions.clear()
-        if definitions:
-            Definition.objects.bulk_create(definitions)
+        definitions = (
+            Definition.objects
+            .filter(user=None, text__isnull=False, word__language__isnull=False)
+            .values_list('word__language_id', 'word__text', 'text')
+            .iterator(chunk_size=batchsize)
+        )
+        for language_id, word_text, text in definitions:
+            key = (language_id, normalize_text(word_text))
+            if key in seen:
+                continue
+            seen.add(key)
+            translations.append(Translation(language_id=language_id, text=key[1], translation=text))
+            if len(translations) >= batchsize:
+                Translation.objects.bulk_create(translations, ignore_conflicts=True)
+                translations.clear()
+        if translations:
+            Translation.objects.bulk_create(translations, ignore_conflicts=True)
 
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {deleted} empty definitions, cached {len(seen)} translations."
+        ))
 
-# python manage.py definition
\ No newline at end of file
+
+# python manage.py definition
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from background_task.models import Task
+from api.tasks import evict_unused_word_sets
+from api.utils import evict_word_sets
+
+class Command(BaseCommand):
+    help = "Deletes word sets that no user references, oldest first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-count', type=int, default=None,
+                            help='Maximum number of word sets to keep (default: WORDSET_MAX_COUNT)')
+        parser.add_argument('--ttl-days', type=int, default=None,
+                            help='Days an unreferenced word set is kept (default: WORDSET_UNREFERENCED_TTL_DAYS)')
+        parser.add_argument('--schedule', action='store_true',
+                            help='Schedule a daily background eviction instead of running now')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            evict_unused_word_sets(repeat=Task.DAILY, remove_existing_tasks=True)
+            self.stdout.write(self.style.SUCCESS("Scheduled daily word set eviction."))
+            return
+
+        evicted = evict_word_sets(options['max_count'], options['ttl_days'])
+        self.stdout.write(self.style.SUCCESS(f"Evicted {evicted} word sets."))
+
+# python manage.py evictwordsets
+# python manage.py evictwordsets --schedule
@@ -1,47 +1,75 @@
 import csv
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from api.models import Word, Language
 
 class Command(BaseCommand):
     help = 'Update IPA values for Polish words from pl_words_ipa.tsv'
 
-    def handle(self, *args, **kwargs):
-        tsv_path = "data/pl_words_ipa.tsv"
-        batch = []
-        updated = 0
-        not_found = 0
+    default_path = "data/pl_words_ipa.tsv"
+    default_language = "Polish"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=str, default=self.default_path,
+                            help='TSV file with Word and IPA columns')
+        parser.add_argument('--language', type=str, default=self.default_language,
+                            help='Language name or abbreviation')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Words updated per statement')
+
+    def handle(self, *args, **options):
+        tsv_path = options['file']
+        language_name = options['language']
 
         max_ipa_len = 0
         longest_ipa_word = None
 
         try:
-            polish = Language.objects.get(name__iexact="Polish")
+            language = Language.objects.get(name__iexact=language_name)
         except Language.DoesNotExist:
-            self.stderr.write("Polish language not found in Language table.")
-            return
+            language = Language.objects.filter(abb__iexact=language_name).first()
+            if language is None:
+                self.stderr.write(f"{language_name} language not found in Language table.")
+                return
 
+        # IPA per word text, the first row winning for repeated words
+        ipa_by_text = {}
+        rows = 0
         with open(tsv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f, delimiter="\t")
             for row in reader:
                 word_text = row["Word"].strip()
                 ipa = row["IPA"].strip()
+                rows += 1
 
                 if len(ipa) > max_ipa_len:
                     max_ipa_len = len(ipa)
                     longest_ipa_word = (word_text, ipa)
 
-                word_qs = Word.objects.filter(text=word_text, language=polish, root=None)
-                if word_qs.exists():
-                    word = word_qs.first()
-                    word.ipa = ipa
-                    batch.append(word)
-                    updated += 1
-                else:
-                    not_found += 1
+                ipa_by_text.setdefault(word_text, ipa)
 
-        Word.objects.bulk_update(batch, ["ipa"])
+        # One pass over the language's root words instead of a lookup per row;
+        # the lowest id wins when several roots share a spelling
+        batch = []
+        matched = set()
+        roots = (
+            Word.objects
+            .filter(language=language, root=None)
+            .order_by('id')
+            .values_list('id', 'text')
+            .iterator(chunk_size=20000)
+        )
+        for word_id, text in roots:
+            if text in ipa_by_text and text not in matched:
+                matched.add(text)
+                batch.append(Word(id=word_id, ipa=ipa_by_text[text]))
+
+        with transaction.atomic():
+            Word.objects.bulk_update(batch, ["ipa"], batch_size=options['batch_size'])
 
-        self.stdout.write(self.style.SUCCESS(f"IPA update prepared for {updated} words."))
+        updated = len(batch)
+        not_found = len(ipa_by_text) - updated
+        self.stdout.write(self.style.SUCCESS(f"IPA updated for {updated} words ({rows} rows read)."))
         if not_found:
             self.stdout.write(f"{not_found} words not found in DB.")
 
@@ -50,3 +78,6 @@ class Command(BaseCommand):
             self.stdout.write("\nLongest IPA:")
             self.stdout.write(f"{word}\t{ipa}")
             self.stdout.write(f"Length: {len(ipa)}")
+
+# python manage.py pl_ipa
+# python manage.py pl_ipa --file data/de_words_ipa.tsv --language German
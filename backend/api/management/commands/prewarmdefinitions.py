@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api.models import Language
+from api.definitions import fill_definitions, undefined_word_ids
+from api.translators import get_translator
+from api.utils import get_common_words
+
+def fill_chunk(word_ids, source, translator):
+    try:
+        return len(fill_definitions(word_ids, source, translator))
+    finally:
+        # Worker threads hold their own connections
+        connection.close()
+
+class Command(BaseCommand):
+    help = "Pre-fills global definitions for the most common words of each language."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--language', action='append', default=None,
+                            help='Language abbreviation, repeatable (default: every language)')
+        parser.add_argument('--top', type=int, default=10000, help='Most common words per language')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Words filled per task')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks filled concurrently')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Most words sent for translation per second (0: no limit)')
+
+    def handle(self, *args, **options):
+        languages = Language.objects.order_by('id')
+        if options['language']:
+            languages = languages.filter(abb__in=options['language'])
+            if not languages.exists():
+                raise CommandError(f"No language matches {', '.join(options['language'])}.")
+
+        for language in languages:
+            self.prewarm(language, options)
+
+    def prewarm(self, language, options):
+        # Words filled by an earlier (possibly interrupted) run are skipped by
+        # undefined_word_ids, so a rerun resumes where that one stopped
+        word_ids = list(get_common_words(language, count=options['top']).values_list('id', flat=True))
+        size = max(1, options['chunk_size'])
+        self.stdout.write(f"{language.abb}: filling the top {len(word_ids)} words...")
+
+        translator = get_translator(language.abb, workers=1)
+        rate = options['rate']
+        checked = 0
+        sent = 0
+        filled = 0
+        started = time.perf_counter()
+
+        def collect(done):
+            nonlocal filled
+            for future in done:
+                pending.pop(future)
+                filled += future.result()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{language.abb}: {checked}/{len(word_ids)} words checked, "
+                              f"{filled} filled ({filled / elapsed:.1f} words/s)")
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            pending = {}
+            for start in range(0, len(word_ids), size):
+                chunk = undefined_word_ids(word_ids[start:start + size])
+                checked = min(start + size, len(word_ids))
+                if not chunk:
+                    continue
+                if rate:
+                    # Hold back until the words sent so far fit the rate
+                    delay = sent / rate - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                sent += len(chunk)
+                pending[executor.submit(fill_chunk, chunk, language.abb, translator)] = start
+                if len(pending) >= 2 * options['workers']:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{language.abb}: filled {filled} definitions in {elapsed:.1f}s "
+            f"({filled / elapsed if elapsed else 0:.1f} words/s)."
+        ))
+
+# python manage.py prewarmdefinitions --language pl --top 10000 --workers 4 --rate 20
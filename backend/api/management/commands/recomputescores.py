@@ -0,0 +1,69 @@
+import multiprocessing
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api.models import WordSet
+from api.utils import recompute_user_video_scores, recompute_word_set_scores
+
+def recompute_shard(target, ids, chunk_size):
+    if target == 'word-sets':
+        return recompute_word_set_scores(ids, chunk_size)
+    return recompute_user_video_scores(ids, chunk_size)
+
+class Command(BaseCommand):
+    help = "Recomputes video scores for all word sets (and users) in vectorized batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['users', 'word-sets'], default=None,
+                            help='What to rescore (default: word-sets in read-through mode, else users)')
+        parser.add_argument('--min-id', type=int, default=None, help='Lowest user or word set id to rescore')
+        parser.add_argument('--max-id', type=int, default=None, help='Highest user or word set id to rescore')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Users or word sets scored per pass')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes, each taking a contiguous id range')
+
+    def handle(self, *args, **options):
+        target = options['target']
+        if target is None:
+            target = 'word-sets' if settings.VIDEO_SCORES_READ_THROUGH else 'users'
+
+        # Stored word set scores (and their matched counts) seed the scores of
+        # every later vocabulary change, referenced by a user or not, so they
+        # are refreshed in full on every run; the id range only narrows the
+        # word sets when they are the target
+        word_sets = WordSet.objects.all()
+        if target == 'word-sets':
+            word_sets = self.filter_ids(word_sets, options)
+        written = self.rescore('word-sets', word_sets, options)
+
+        if target == 'users':
+            written += self.rescore('users', self.filter_ids(User.objects.all(), options), options)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} scores."))
+
+    def filter_ids(self, qs, options):
+        if options['min_id'] is not None:
+            qs = qs.filter(id__gte=options['min_id'])
+        if options['max_id'] is not None:
+            qs = qs.filter(id__lte=options['max_id'])
+        return qs
+
+    def rescore(self, target, qs, options):
+        ids = list(qs.order_by('id').values_list('id', flat=True))
+
+        processes = max(1, min(options['processes'], len(ids)))
+        shard_size = -(-len(ids) // processes) if ids else 0
+        shards = [ids[i:i + shard_size] for i in range(0, len(ids), shard_size)] if ids else []
+
+        self.stdout.write(f"Rescoring {len(ids)} {target} in {len(shards)} shard(s)...")
+        if processes == 1:
+            return sum(recompute_shard(target, shard, options['chunk_size']) for shard in shards)
+
+        # Workers open their own database connections after the fork
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return sum(pool.starmap(
+                recompute_shard, [(target, shard, options['chunk_size']) for shard in shards]
+            ))
+
+# python manage.py recomputescores --processes 4
@@ -1,23 +1,86 @@
+import csv
+from collections import defaultdict
+from itertools import groupby
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from api.models import Word, Language
-from collections import defaultdict
-import pandas as pd
+from api.lexicon import invalidate_word_index
+
+infinitiveTag = "inf"
+
+def read_lemma_groups(filepath):
+    """
+    Stream the .tab file as (lemma, rows) for each run of consecutive rows
+    sharing a lemma, skipping first names and surnames. Only one group is
+    held in memory at a time.
+    """
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        rows = (
+            row for row in reader
+            if not ({"imię", "nazwisko"} & set((row['desc'] or "").split("|")))
+        )
+        for lemma, group in groupby(rows, key=lambda row: row['lemma'].split(':')[0]):
+            yield lemma, list(group)
+
+def split_lemma_group(lemma, rows):
+    """
+    Pick the root row of a lemma group and the rows derived from it. The
+    infinitive is the root if there is one; otherwise it is the row whose
+    tag class (e.g. subst, adj) the most forms share. Returns (root, derived),
+    or None if no row spells the lemma itself.
+    """
+    infinitive = None
+    heldRoots = []
+    heldRows = []
+    for row in rows:
+        if row['form'] == lemma:
+            if row['tag'].split(":")[0] == infinitiveTag and infinitive is None:
+                infinitive = row
+            else:
+                heldRoots.append(row)
+        else:
+            heldRows.append(row)
 
-# Read the .tab file into a DataFrame
+    if infinitive is not None:
+        return infinitive, heldRows + heldRoots
+    if not heldRoots:
+        return None
+
+    tagMap = {}
+    for heldRoot in heldRoots:
+        rootTag = heldRoot['tag'].split(":")[0]
+        if rootTag in tagMap:
+            heldRows.append(heldRoot)
+        else:
+            tagMap[rootTag] = heldRoot
+
+    tagCount = defaultdict(int)
+    for heldrow in heldRows:
+        rootTag = heldrow['tag'].split(":")[0]
+        if rootTag in tagMap:
+            tagCount[rootTag] += 1
+    if tagCount:
+        root_row = tagMap.pop(max(tagCount, key=tagCount.get))
+    else:
+        root_row = tagMap.pop(next(iter(tagMap)))
+    return root_row, list(tagMap.values()) + heldRows
+
+def make_word(row, language, root=None):
+    return Word(text=row['form'], language=language, tag=row['tag'],
+                wtype=row['desc'] or None, abb=row['abb'] or None, root=root)
 
 class Command(BaseCommand):
     help = 'Import tab file'
 
     def add_arguments(self, parser):
         parser.add_argument('filepath', type=str)
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Words held before the roots and then their forms are bulk inserted')
 
     def handle(self, *args, **options):
         filepath = str(options['filepath'])
-
-        df = pd.read_csv(filepath, delimiter='\t')
-
-        words = []
-        batchsize = 10000
+        batch_size = options['batch_size']
 
         lang = "pl"
         langname = "Polish"
@@ -25,95 +88,40 @@ class Command(BaseCommand):
             name=langname, abb=lang
         )
 
-        infinitiveTag = "inf"
-
-        currRootForm = ""
-        currRootObject = None
-        rootExists = False
-        infExists = False
-        heldRows = []
-        heldRoots = []
-        for row in df.itertuples():
-            if not pd.isna(row.desc):
-                desc = row.desc.split("|")
-                if "imię" in desc or "nazwisko" in desc:
-                    continue
-            form = row.form
-            lemma = row.lemma
-            lemma = lemma.split(':')[0]
+        groups = []
+        held = 0
+        lemma_count = 0
+        word_count = 0
+        for lemma, rows in read_lemma_groups(filepath):
+            group = split_lemma_group(lemma, rows)
+            if group is None:
+                continue
+            groups.append(group)
+            held += 1 + len(group[1])
+            if held >= batch_size:
+                word_count += self.write(groups, pl, batch_size)
+                lemma_count += len(groups)
+                groups = []
+                held = 0
+                self.stdout.write(f"{lemma_count} lemmas, {word_count} words")
+        if groups:
+            word_count += self.write(groups, pl, batch_size)
+            lemma_count += len(groups)
 
-            if lemma != currRootForm:
-                if rootExists:
-                    if infExists:
-                        heldRows = heldRows + heldRoots
-                        for heldrow in heldRows:
-                            w = Word(text=heldrow.form, language=pl, tag=heldrow.tag,
-                                    wtype=heldrow.desc, abb=heldrow.abb, 
-                                    root=currRootObject)
-                            words.append(w)
-                    else:
-                        tagMap = {}
-                        for heldRoot in heldRoots:
-                            rootTag = heldRoot.tag.split(":")[0]
-                            if rootTag in tagMap:
-                                heldRows.append(heldRoot)
-                            else:
-                                rootw = Word(text=heldRoot.form, language=pl, tag=heldRoot.tag,
-                                                       wtype=heldRoot.desc, abb=heldRoot.abb, root=None)
-                                tagMap[rootTag] = heldRoot
-                        
-                        tagCount = defaultdict(int)
-                        for heldrow in heldRows:
-                            rootTag = heldrow.tag.split(":")[0]
-                            if rootTag in tagMap:
-                                tagCount[rootTag] += 1
-                        if tagCount:
-                            max_tag = max(tagCount, key=tagCount.get)
-                            root_word = tagMap.pop(max_tag)
-                        else:
-                            first_key = next(iter(tagMap))
-                            root_word = tagMap.pop(first_key)
-                        rootw = Word(text=root_word.form, language=pl, tag=root_word.tag,
-                                        wtype=root_word.desc, abb=root_word.abb, root=None)
-                        rootw.save()
-                        for key, value in tagMap.items():
-                            w = Word(text=value.form, language=pl, tag=value.tag,
-                                wtype=value.desc, abb=value.abb, 
-                                root=rootw)
-                            words.append(w)
-                        for heldrow in heldRows:
-                            w = Word(text=heldrow.form, language=pl, tag=heldrow.tag,
-                                wtype=heldrow.desc, abb=heldrow.abb, 
-                                root=rootw)
-                            words.append(w)                            
-                    heldRows = []
-                    heldRoots = []
-                    currRootForm = lemma
-                    rootExists = False
-                    infExists = False
-                    if len(words) > batchsize:
-                        Word.objects.bulk_create(words)
-                        words = []
-                else:
-                    heldRows = []
-                    currRootForm = lemma
-                    rootExists = False
-                    infExists = False
+        invalidate_word_index()
+        self.stdout.write(self.style.SUCCESS(f"Imported {lemma_count} lemmas, {word_count} words."))
 
-            # root
-            if form == lemma:
-                if row.tag.split(":")[0] == infinitiveTag and not infExists:
-                    currRootObject = Word(text=form, language=pl, tag=row.tag,
-                                            wtype=row.desc, abb=row.abb, 
-                                            root=None)
-                    currRootObject.save()
-                    infExists = True
-                else:
-                    heldRoots.append(row)
-                rootExists = True
-            else:
-                heldRows.append(row)
-        if words:
-            Word.objects.bulk_create(words)
+    def write(self, groups, language, batch_size):
+        # Roots go in first so their ids are known when the forms are built
+        with transaction.atomic():
+            roots = Word.objects.bulk_create(
+                [make_word(root_row, language) for root_row, _ in groups], batch_size=batch_size
+            )
+            derived = [
+                make_word(row, language, root)
+                for root, (_, rows) in zip(roots, groups) for row in rows
+            ]
+            Word.objects.bulk_create(derived, batch_size=batch_size)
+        return len(roots) + len(derived)
 
-# python manage.py tabimport "data/sgjp-20240929.tab"
\ No newline at end of file
+# python manage.py tabimport "data/sgjp-20240929.tab" --batch-size 20000
@@ -1,4 +1,3 @@
-from youtube_transcript_api import YouTubeTranscriptApi
 import string
 from math import floor, ceil
 import scrapetube
@@ -6,15 +5,34 @@ import stanza
 import re
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.conf import settings
 from api.models import (
-    Word, Channel, Video, Sentence, WordInstance, Language, UserVideo, User,
-    WordSet, WordSetVideoScore
+    Channel, Video, Sentence, WordInstance, Language,
+    WordSet, WordSetVideoScore, VideoWordCount
 )
+from api.scoring import get_score_matrix
+from api.bulkload import bulk_insert
+from api.lexicon import ImportLexicon
+from api.transcripts import (
+    YouTubeTranscriptFetcher, DirectoryTranscriptFetcher, TranscriptUnavailable, fetch_transcripts
+)
+from api.utils import (
+    build_video_word_counts, increment_word_instance_counts, user_id_ranges, propagate_video_scores
+)
+from api.tasks import propagate_new_video_scores
 
-nlp = stanza.Pipeline("pl", processors="tokenize,pos", tokenize_pretokenized=True)
+_nlp = None
+
+def get_pipeline():
+    # Loaded on first use so importing this module (e.g. before forking
+    # ingest workers) does not load the Stanza models
+    global _nlp
+    if _nlp is None:
+        _nlp = stanza.Pipeline("pl", processors="tokenize,pos", tokenize_pretokenized=True)
+    return _nlp
 
 def classify_polish_pos(text):
-    doc = nlp(text)
+    doc = get_pipeline()(text)
     pos_tags = []
     
     for sentence in doc.sentences:
@@ -22,30 +40,50 @@ def classify_polish_pos(text):
             pos_tags.append((word.text, word.upos))
     return pos_tags
 
-def best_match(stanza_pos, datawords):
-    target_parts = stanza_pos.split(":")
-    target_first = target_parts[0]
-
-    def count_matching_components(word):
-        if not word.tag:
-            return -1
+def clean_segment_text(text):
+    text = text.replace("[Muzyka]", "").replace("[muzyka]", "").strip()
+    return text.translate(str.maketrans('', '', string.punctuation))
 
-        word_parts = word.tag.split(":")
-        
-        # Ensure the first component matches
-        if word_parts[0] != target_first:
-            return -1
-        
-        # Count matching elements
-        return sum(1 for part in word_parts if part in target_parts)
-
-    # Filter valid candidates (must start with the same first component)
-    valid_candidates = [word for word in datawords if word.tag and word.tag.startswith(target_first)]
-
-    # Find the best match (max matching components)
-    best_match = max(valid_candidates, key=count_matching_components, default=None)
-
-    return best_match
+def tag_transcripts(transcripts):
+    """
+    POS tag every segment of several transcripts with a single Stanza call.
+    Each segment is passed as one pretokenized sentence, so the tags map
+    straight back to their segment. Returns, per transcript, a list with the
+    (token, upos) pairs of each segment.
+    """
+    segments = [
+        (t, s, clean_segment_text(entry['text']).split())
+        for t, transcript in enumerate(transcripts)
+        for s, entry in enumerate(transcript)
+    ]
+    segments = [segment for segment in segments if segment[2]]
+
+    tagged = [[[] for _ in transcript] for transcript in transcripts]
+    if segments:
+        doc = get_pipeline()([tokens for _, _, tokens in segments])
+        for (t, s, _), sentence in zip(segments, doc.sentences):
+            tagged[t][s] = [(word.text, word.upos) for word in sentence.words]
+    return tagged
+
+def transcript_word_instances(transcript, transcript_pos, lexicon):
+    """
+    (word_id, start, end) for every token of a tagged transcript that the
+    lexicon resolves to a word.
+    """
+    instances = []
+    for sec, text_pos in zip(transcript, transcript_pos):
+        '''
+        sec is dict w/:
+        'text', 'start', 'duration'
+        '''
+        start = floor(sec['start'])
+        end = ceil(start+sec['duration'])
+        all_words = clean_segment_text(sec['text']).lower().split()
+        for i, word in enumerate(all_words):
+            word_id = lexicon.resolve(word, text_pos[i][1])
+            if word_id:
+                instances.append((word_id, start, end))
+    return instances
 
 def extract_sentences(transcript_data, video, word_threshold=15):
     sentence_list = []
@@ -121,29 +159,28 @@ def extract_sentences(transcript_data, video, word_threshold=15):
         ))
     return sentence_list
 
-def calculate_score_for_video(video, word_ids):
-    related_root_word_ids = set(
-        Word.objects.filter(root_id__in=word_ids).values_list('id', flat=True)
-    )
-    all_matched_ids = word_ids | related_root_word_ids
-
-    total_instances = WordInstance.objects.filter(video=video).count()
-    if total_instances == 0:
-        return 0
-
-    matched_count = WordInstance.objects.filter(
-        video=video,
-        word_id__in=all_matched_ids
-    ).count()
-
-    return round((matched_count / total_instances) * 100)
+def save_videos(videos, sentences, wordinstances, use_copy=None):
+    """
+    Save a batch of new videos with their sentences, word instances and
+    per-word counts, and add those counts to the root words' instance_count.
+    Videos are inserted first so the rest can reference their ids.
+    """
+    word_counts = build_video_word_counts(wordinstances)
+    with transaction.atomic():
+        Video.objects.bulk_create(videos)
+        bulk_insert(Sentence, sentences, use_copy)
+        bulk_insert(WordInstance, wordinstances, use_copy)
+        bulk_insert(VideoWordCount, word_counts, use_copy)
+        increment_word_instance_counts(word_counts)
 
 def update_wordset_scores_for_new_videos(new_videos):
     """
-    For each WordSet, compute and insert missing video scores for new_videos.
-    Does not overwrite or delete existing scores.
+    For each WordSet in use by a user, compute and insert missing video scores
+    for new_videos. Does not overwrite or delete existing scores. Unreferenced
+    sets are filled in if a user picks them up again.
     """
-    for wordset in WordSet.objects.iterator():
+    score_matrix = get_score_matrix()
+    for wordset in WordSet.objects.filter(userpreferences__isnull=False).distinct().iterator():
         word_ids = set(wordset.words.values_list('id', flat=True))
         if not word_ids:
             continue
@@ -161,62 +198,31 @@ def update_wordset_scores_for_new_videos(new_videos):
         if not videos_to_score:
             continue
 
-        new_scores = []
-        for video in videos_to_score:
-            score = calculate_score_for_video(video, word_ids)
-            new_scores.append(WordSetVideoScore(
-                word_set=wordset,
-                video=video,
-                score=score
-            ))
+        video_scores = score_matrix.matched_list(word_ids, [video.id for video in videos_to_score])
+        new_scores = [
+            WordSetVideoScore(word_set=wordset, video_id=video_id, score=score, matched_count=matched)
+            for video_id, score, matched in video_scores
+        ]
 
         if new_scores:
             with transaction.atomic():
                 WordSetVideoScore.objects.bulk_create(new_scores, batch_size=500)
 
-def update_user_video_scores_for_new_videos(new_videos):
-    users = User.objects.select_related('userpreferences').all()
-
-    for user in users:
-        prefs = getattr(user, 'userpreferences', None)
-        if not prefs or not prefs.word_set:
-            continue  # Skip users with no preferences or word set
-
-        word_set = prefs.word_set
-
-        # Get relevant video scores for the user's word set and new videos
-        wsvs = WordSetVideoScore.objects.filter(
-            word_set=word_set,
-            video__in=new_videos
-        ).values_list('video_id', 'score')
-
-        score_map = dict(wsvs)
-        if not score_map:
-            continue
+def update_user_video_scores_for_new_videos(new_videos, user_chunk_size=5000, background=False):
+    """
+    Copy every user's word set scores for new_videos into UserVideo, one
+    set-based upsert per user id range. With background=True each range is
+    queued as a task so several workers can process them in parallel.
+    """
+    video_ids = [video.id for video in new_videos]
+    if not video_ids:
+        return
 
-        existing_uv = UserVideo.objects.filter(
-            user=user,
-            video_id__in=score_map.keys()
-        )
-        existing_uv_map = {uv.video_id: uv for uv in existing_uv}
-
-        to_create = []
-        to_update = []
-
-        for video_id, score in score_map.items():
-            if video_id in existing_uv_map:
-                uv = existing_uv_map[video_id]
-                if uv.score != score:
-                    uv.score = score
-                    to_update.append(uv)
-            else:
-                to_create.append(UserVideo(user=user, video_id=video_id, score=score))
-
-        with transaction.atomic():
-            if to_create:
-                UserVideo.objects.bulk_create(to_create, batch_size=500)
-            if to_update:
-                UserVideo.objects.bulk_update(to_update, ['score'], batch_size=500)
+    for min_user_id, max_user_id in user_id_ranges(user_chunk_size):
+        if background:
+            propagate_new_video_scores(video_ids, min_user_id, max_user_id)
+        else:
+            propagate_video_scores(video_ids, min_user_id, max_user_id)
 
 class Command(BaseCommand):
     help = "Imports data into the Word, Channel, Video, and WordInstance models"
@@ -224,6 +230,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('channel_url', type=str)
         parser.add_argument('language', type=str)
+        parser.add_argument('--user-chunk-size', type=int, default=5000,
+                            help='Number of user ids per score propagation statement')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue score propagation as background tasks')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of transcripts fetched concurrently')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Retries with exponential backoff for failed transcript requests')
+        parser.add_argument('--transcripts-dir', type=str, default=None,
+                            help='Import the videos in <dir>/<video id>.json instead of the channel on YouTube')
+        parser.add_argument('--copy', action='store_true',
+                            help='Load sentences and word instances with COPY (PostgreSQL only)')
 
     def handle(self, *args, **options):
         channel_url = str(options['channel_url'])
@@ -238,23 +256,40 @@ class Command(BaseCommand):
         wordinstances = []
 
         channel_name = channel_url.split("@")[-1]
-        channel_videos = scrapetube.get_channel(channel_url=channel_url)
 
         channel, _ = Channel.objects.get_or_create(
             url=channel_url,
             name=channel_name
         )
-        for j, video in enumerate(channel_videos):
-            videoID = video['videoId']
-            if Video.objects.filter(url=videoID).exists():
-                continue
-            title = str(video['title']['runs'][0]['text'])
-            try:
-                tr = YouTubeTranscriptApi.get_transcript(videoID, 
-                                                         languages=[language])
-            # except RequestBlocked:
-            #     break
-            except:
+        lexicon = ImportLexicon(language_object)
+        existing_urls = set(Video.objects.values_list('url', flat=True))
+
+        def new_channel_videos():
+            for video in scrapetube.get_channel(channel_url=channel_url):
+                videoID = video['videoId']
+                if videoID not in existing_urls:
+                    yield videoID, str(video['title']['runs'][0]['text'])
+
+        def new_directory_videos(fetcher):
+            # Offline run: the directory lists the videos and holds their titles
+            for videoID in fetcher.video_ids():
+                if videoID in existing_urls:
+                    continue
+                try:
+                    data = fetcher.load(videoID)
+                except TranscriptUnavailable:
+                    yield videoID, videoID, None
+                    continue
+                yield videoID, str(data.get('title', videoID)), data.get('transcript')
+
+        if options['transcripts_dir']:
+            fetched = new_directory_videos(DirectoryTranscriptFetcher(options['transcripts_dir']))
+        else:
+            # Transcripts are fetched concurrently while earlier ones are tagged and saved
+            fetcher = YouTubeTranscriptFetcher(retries=options['retries'])
+            fetched = fetch_transcripts(fetcher, new_channel_videos(), language, options['workers'])
+        for j, (videoID, title, tr) in enumerate(fetched):
+            if tr is None:
                 continue
             auto = True
             # transcript_list = YouTubeTranscriptApi.list_transcripts(videoID)
@@ -267,84 +302,29 @@ class Command(BaseCommand):
             new_videos.append(vid)
             sentence_list = extract_sentences(tr, vid)
             sentences.extend(sentence_list)
-            for sec in tr:
-                '''
-                sec is dict w/:
-                'text', 'start', 'duration'
-                '''
-                start = floor(sec['start'])
-                end = ceil(start+sec['duration'])
-                text = sec['text']
-
-                if language=='pl':
-                    text = text.replace("[Muzyka]", "").replace("[muzyka]", "").strip()
-                    text = text.translate(str.maketrans('','',string.punctuation))
-                    text_pos = classify_polish_pos(text)
-                    all_words = text.lower().split()
-                    existing_words = set(Word.objects.filter(text__in=all_words).values_list('text', flat=True))
-                    for i in range(len(all_words)):
-                        word = all_words[i]
-                        
-                        stanza_pos = text_pos[i][1]
-
-                        if word in existing_words:
-                            datawords = Word.objects.filter(text=word)
-                            
-                            # edge cases
-                            if word == 'też':
-                                dataword = Word.objects.filter(text=word, root=None)
-                                if dataword:
-                                    wordinstances.append(WordInstance(word=dataword.first(), video=vid, start=start, end=end))
-                                continue
-                            elif word == 'mam':
-                                dataword = Word.objects.filter(text=word, tag='fin:sg:pri:imperf')
-                                if dataword:
-                                    wordinstances.append(WordInstance(word=dataword.first(), video=vid, start=start, end=end))
-                                continue
-                            elif word == 'mają':
-                                dataword = Word.objects.filter(text=word, root__text='mieć')
-                                if dataword:
-                                    wordinstances.append(WordInstance(word=dataword.first(), video=vid, start=start, end=end))
-                                continue
-                            elif word == 'mieć':
-                                dataword = Word.objects.filter(text=word, root=None)
-                                if dataword:
-                                    wordinstances.append(WordInstance(word=dataword.first(), video=vid, start=start, end=end))
-                                continue
-
-                            datawords = Word.objects.filter(text=word)
-                            if datawords.count() == 1:
-                                wordinstances.append(WordInstance(word=datawords.first(), 
-                                                                    video=vid, start=start, end=end))
-                            else:
-                                dataword = next((dw for dw in datawords if dw.tag and dw.tag == stanza_pos), None)
-                                if dataword:
-                                    wordinstances.append(WordInstance(word=dataword, 
-                                                                        video=vid, start=start, end=end))
-                                else:
-                                    dataword = best_match(stanza_pos, datawords)
-                                    if dataword:
-                                        wordinstances.append(WordInstance(word=dataword, 
-                                                                            video=vid, start=start, end=end))
-                                    else:
-                                        wordinstances.append(WordInstance(word=datawords.first(), 
-                                                                            video=vid, start=start, end=end))
-                elif language == 'de':
-
-                    return
+            if language=='pl':
+                # Tag the whole transcript at once rather than segment by segment
+                transcript_pos = tag_transcripts([tr])[0]
+                lexicon.prefetch(
+                    token.lower() for segment in transcript_pos for token, _ in segment
+                )
+                for word_id, start, end in transcript_word_instances(tr, transcript_pos, lexicon):
+                    wordinstances.append(WordInstance(word_id=word_id, video=vid, start=start, end=end))
+            elif language == 'de' and tr:
+
+                return
             if j % video_batch_size == 0 and j > 0:
-                Video.objects.bulk_create(videos)
-                Sentence.objects.bulk_create(sentences)
-                WordInstance.objects.bulk_create(wordinstances)
+                save_videos(videos, sentences, wordinstances, options['copy'] or None)
                 videos = []
                 sentences = []
                 wordinstances = []
-        Video.objects.bulk_create(videos)
-        Sentence.objects.bulk_create(sentences)
-        WordInstance.objects.bulk_create(wordinstances)
+        save_videos(videos, sentences, wordinstances, options['copy'] or None)
 
         update_wordset_scores_for_new_videos(new_videos)
-        update_user_video_scores_for_new_videos(new_videos)
+        if not settings.VIDEO_SCORES_READ_THROUGH:
+            update_user_video_scores_for_new_videos(
+                new_videos, options['user_chunk_size'], options['background']
+            )
 
 '''
 poetry run python manage.py ytimport "https://www.youtube.com/@EasyPolish" "pl"
@@ -49,6 +49,18 @@ class Definition(models.Model):
     word = models.ForeignKey(Word, on_delete=models.CASCADE)
     text = models.TextField(null=True)
 
+class Translation(models.Model):
+    # Machine translation of a normalized spelling, shared by every word
+    # (form or homograph) of the language written that way
+    language = models.ForeignKey(Language, on_delete=models.CASCADE)
+    text = models.CharField(max_length=80)
+    translation = models.TextField(default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['language', 'text'], name='unique_translation')
+        ]
+
 class Channel(models.Model):
     url = models.CharField(max_length=100)
     name = models.CharField(max_length=100, default="NA", null=True)
@@ -66,18 +78,39 @@ class Video(models.Model):
     language = models.ForeignKey(Language, on_delete=models.SET_NULL, null=True)
     auto_generated = models.BooleanField(default=True)
     genre = models.ManyToManyField(Genre, related_name='videos', blank=True)
+    instance_count = models.IntegerField(default=0)
 
 class UserVideo(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
     score = models.IntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'video'], name='unique_user_video')
+        ]
+        indexes = [
+            # Serves get_videos' keyset pages as one index range scan
+            models.Index(fields=['user', 'score', 'video'], name='user_video_score_idx')
+        ]
+
 class WordInstance(models.Model):
     word = models.ForeignKey(Word, on_delete=models.CASCADE)
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
     start = models.IntegerField(default=0, db_index=True)
     end = models.IntegerField(default=0, db_index=True)
 
+class VideoWordCount(models.Model):
+    # Number of instances of a root word (and its derived words) in a video
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='word_counts')
+    word = models.ForeignKey(Word, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'word'], name='unique_video_word_count')
+        ]
+
 class Sentence(models.Model):
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
     text = models.CharField(max_length=300, default="")
@@ -122,14 +155,19 @@ class WordSet(models.Model):
     words = models.ManyToManyField(Word)
     hash = models.CharField(max_length=64, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=now, db_index=True)
 
 class WordSetVideoScore(models.Model):
     word_set = models.ForeignKey(WordSet, on_delete=models.CASCADE, related_name='video_scores')
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
     score = models.IntegerField()
-    
+    matched_count = models.IntegerField(null=True, default=None)
+
     class Meta:
         unique_together = ('word_set', 'video')
+        indexes = [
+            models.Index(fields=['word_set', 'score', 'video'], name='word_set_score_idx')
+        ]
 
 class UserPreferences(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
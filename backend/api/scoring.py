@@ -0,0 +1,281 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, Max, Exists, OuterRef
+from django.db.models.functions import Coalesce
+from .models import WordInstance, Video, VideoWordCount
+from .lexicon import resolve_root_ids
+
+_matrix = None
+_matrix_key = None
+_counts_checked = False
+
+def rebuild_video_word_counts(video_ids):
+    """
+    Recompute VideoWordCount rows and instance_count for saved videos from
+    their WordInstance rows.
+    """
+    rows = (
+        WordInstance.objects
+        .filter(video_id__in=video_ids)
+        .annotate(root_word_id=Coalesce('word__root_id', 'word_id'))
+        .values('video_id', 'root_word_id')
+        .annotate(count=Count('id'))
+        .values_list('video_id', 'root_word_id', 'count')
+    )
+
+    word_counts = []
+    totals = defaultdict(int)
+    for video_id, word_id, count in rows:
+        word_counts.append(VideoWordCount(video_id=video_id, word_id=word_id, count=count))
+        totals[video_id] += count
+
+    videos = list(Video.objects.filter(id__in=video_ids).only('id'))
+    for video in videos:
+        video.instance_count = totals[video.id]
+
+    with transaction.atomic():
+        VideoWordCount.objects.filter(video_id__in=video_ids).delete()
+        VideoWordCount.objects.bulk_create(word_counts, batch_size=1000)
+        Video.objects.bulk_update(videos, ['instance_count'], batch_size=1000)
+
+def ensure_video_word_counts(batch_size=100):
+    """
+    Count the words of videos imported before per-video word counts were
+    kept (word instances but no instance_count yet), once per process, so
+    they are scored and listed without running countvideowords first.
+    Returns the number of videos counted.
+    """
+    global _counts_checked
+    if _counts_checked:
+        return 0
+
+    video_ids = list(
+        Video.objects
+        .filter(instance_count=0)
+        .filter(Exists(WordInstance.objects.filter(video=OuterRef('pk'))))
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    for i in range(0, len(video_ids), batch_size):
+        rebuild_video_word_counts(video_ids[i:i + batch_size])
+    _counts_checked = True
+    return len(video_ids)
+
+def split_word_ids(word_ids):
+    """
+    Split a vocabulary into root words, which cover their whole inflection
+    family, and loose derived forms whose root is not part of the vocabulary.
+    """
+    word_ids = np.unique(np.asarray(list(word_ids), dtype=np.int64))
+    # Words added since the index was loaded are looked up in the database
+    # rather than dropped from the vocabulary
+    root_ids = resolve_root_ids(word_ids)
+
+    is_root = root_ids == word_ids
+    is_loose = (root_ids != -1) & ~is_root & ~np.isin(root_ids, word_ids)
+    return word_ids[is_root], word_ids[is_loose]
+
+def _positions(sorted_ids, ids):
+    """
+    Indices into the sorted id array for every id in ids that it contains.
+    """
+    ids = np.unique(np.asarray(list(ids), dtype=np.int64))
+    positions = np.searchsorted(sorted_ids, ids)
+    found = positions < len(sorted_ids)
+    positions, ids = positions[found], ids[found]
+    return positions[sorted_ids[positions] == ids]
+
+class VideoScoreMatrix:
+    """
+    Video x root-word instance counts held as a CSR matrix, so a whole word
+    set can be scored against every video with one matrix-vector product.
+    """
+
+    def __init__(self, video_ids, root_ids, row_ids, col_ids, counts, totals):
+        self.video_ids = video_ids
+        self.root_ids = root_ids
+        self.totals = totals
+        self.counts = csr_matrix(
+            (counts, (row_ids, col_ids)),
+            shape=(len(video_ids), len(root_ids)),
+            dtype=np.int64
+        )
+
+    @classmethod
+    def from_database(cls):
+        videos = np.array(
+            Video.objects.order_by('id').values_list('id', 'instance_count'),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        video_ids = videos[:, 0]
+
+        rows = VideoWordCount.objects.values_list('video_id', 'word_id', 'count')
+        data = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+        data = data[np.isin(data[:, 0], video_ids)]
+
+        root_ids, col_ids = np.unique(data[:, 1], return_inverse=True)
+        row_ids = np.searchsorted(video_ids, data[:, 0])
+
+        return cls(video_ids, root_ids, row_ids, col_ids.ravel(), data[:, 2], videos[:, 1])
+
+    def _rows(self, video_ids):
+        if video_ids is None:
+            return np.arange(len(self.video_ids))
+        return _positions(self.video_ids, video_ids)
+
+    def matched_counts(self, roots, loose):
+        """
+        Number of instances in each video whose word is covered by the given
+        root words (including their derived forms) or loose derived forms.
+        """
+        known = np.zeros(len(self.root_ids), dtype=np.int64)
+        known[_positions(self.root_ids, roots)] = 1
+        matched = self.counts @ known
+
+        if len(loose):
+            loose_counts = (
+                WordInstance.objects
+                .filter(word_id__in=loose.tolist())
+                .values('video_id')
+                .annotate(count=Count('id'))
+                .values_list('video_id', 'count')
+            )
+            data = np.array(list(loose_counts), dtype=np.int64).reshape(-1, 2)
+            data = data[np.isin(data[:, 0], self.video_ids)]
+            np.add.at(matched, np.searchsorted(self.video_ids, data[:, 0]), data[:, 1])
+
+        return matched
+
+    def batch_matched_counts(self, vocabularies):
+        """
+        Matched instance counts for many vocabularies at once, as a
+        len(vocabularies) x videos array: one sparse product of a vocabulary x
+        root-word known matrix with the video x root-word counts, plus the
+        counts of loose derived forms.
+        """
+        known_rows, known_cols = [], []
+        loose_rows, loose_ids = [], []
+        for i, word_ids in enumerate(vocabularies):
+            roots, loose = split_word_ids(word_ids)
+            cols = _positions(self.root_ids, roots)
+            known_rows.append(np.full(len(cols), i))
+            known_cols.append(cols)
+            loose_rows.append(np.full(len(loose), i))
+            loose_ids.append(loose)
+
+        known_rows = np.concatenate(known_rows) if known_rows else np.empty(0, dtype=np.int64)
+        known_cols = np.concatenate(known_cols) if known_cols else np.empty(0, dtype=np.int64)
+        known = csr_matrix(
+            (np.ones(len(known_rows), dtype=np.int64), (known_rows, known_cols)),
+            shape=(len(vocabularies), len(self.root_ids))
+        )
+        matched = (known @ self.counts.T).toarray()
+
+        loose_rows = np.concatenate(loose_rows) if loose_rows else np.empty(0, dtype=np.int64)
+        loose_ids = np.concatenate(loose_ids) if loose_ids else np.empty(0, dtype=np.int64)
+        if len(loose_ids):
+            words, word_cols = np.unique(loose_ids, return_inverse=True)
+            rows = (
+                WordInstance.objects
+                .filter(word_id__in=words.tolist())
+                .values('word_id', 'video_id')
+                .annotate(count=Count('id'))
+                .values_list('word_id', 'video_id', 'count')
+            )
+            data = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+            data = data[np.isin(data[:, 1], self.video_ids)]
+            loose_counts = csr_matrix(
+                (data[:, 2], (np.searchsorted(words, data[:, 0]), np.searchsorted(self.video_ids, data[:, 1]))),
+                shape=(len(words), len(self.video_ids))
+            )
+            owners = csr_matrix(
+                (np.ones(len(loose_rows), dtype=np.int64), (loose_rows, word_cols.ravel())),
+                shape=(len(vocabularies), len(words))
+            )
+            matched += (owners @ loose_counts).toarray()
+
+        return matched
+
+    def scores(self, matched):
+        totals = self.totals
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(totals > 0, np.rint(matched / totals * 100), 0)
+        return scores.astype(np.int64)
+
+    def _matched_list(self, matched, video_ids=None):
+        scores = self.scores(matched)
+        rows = self._rows(video_ids)
+        return [(int(self.video_ids[r]), int(scores[r]), int(matched[r])) for r in rows]
+
+    def matched_list(self, word_ids, video_ids=None):
+        """
+        Return (video_id, score, matched_count) tuples for the given word set,
+        where score is the rounded percentage of a video's word instances that
+        are known and matched_count is the number of known instances.
+        """
+        roots, loose = split_word_ids(word_ids)
+        return self._matched_list(self.matched_counts(roots, loose), video_ids)
+
+    def score_list(self, word_ids, video_ids=None):
+        return [(video_id, score) for video_id, score, _ in self.matched_list(word_ids, video_ids)]
+
+    def delta_counts(self, old_word_ids, new_word_ids):
+        """
+        Per-video change in matched instances when a vocabulary goes from
+        old_word_ids to new_word_ids, computed from the changed words only.
+        """
+        old_roots, old_loose = split_word_ids(old_word_ids)
+        new_roots, new_loose = split_word_ids(new_word_ids)
+
+        added = self.matched_counts(np.setdiff1d(new_roots, old_roots), np.setdiff1d(new_loose, old_loose))
+        removed = self.matched_counts(np.setdiff1d(old_roots, new_roots), np.setdiff1d(old_loose, new_loose))
+        return added - removed
+
+    def incremental_matched_list(self, old_word_ids, new_word_ids, old_matched):
+        """
+        Like matched_list for new_word_ids, but derived from the matched counts
+        of a previously scored vocabulary (a video_id -> count mapping) plus
+        the counts of the added and removed words. Videos missing from
+        old_matched are scored from scratch.
+        """
+        matched = np.zeros(len(self.video_ids), dtype=np.int64)
+        scored = np.zeros(len(self.video_ids), dtype=bool)
+        if old_matched:
+            old_video_ids = np.fromiter(old_matched.keys(), dtype=np.int64, count=len(old_matched))
+            old_counts = np.fromiter(old_matched.values(), dtype=np.int64, count=len(old_matched))
+            in_matrix = np.isin(old_video_ids, self.video_ids)
+            rows = np.searchsorted(self.video_ids, old_video_ids[in_matrix])
+            matched[rows] = old_counts[in_matrix]
+            scored[rows] = True
+
+        matched[scored] += self.delta_counts(old_word_ids, new_word_ids)[scored]
+        if not scored.all():
+            roots, loose = split_word_ids(new_word_ids)
+            matched[~scored] = self.matched_counts(roots, loose)[~scored]
+
+        return self._matched_list(matched)
+
+def get_score_matrix():
+    """
+    Return the process-wide score matrix, rebuilding it when videos or video
+    word counts have been added or removed since it was last loaded.
+    """
+    global _matrix, _matrix_key
+
+    ensure_video_word_counts()
+    videos = Video.objects.aggregate(max_id=Max('id'), count=Count('id'))
+    word_counts = VideoWordCount.objects.aggregate(max_id=Max('id'))
+    key = (videos['max_id'], videos['count'], word_counts['max_id'])
+
+    if _matrix is None or key != _matrix_key:
+        _matrix = VideoScoreMatrix.from_database()
+        _matrix_key = key
+    return _matrix
+
+def invalidate_score_matrix():
+    global _matrix, _matrix_key, _counts_checked
+    _matrix = None
+    _matrix_key = None
+    _counts_checked = False
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from .models import (
     UserPreferences, Language, Word, UserWord, Definition,
-    Video, Channel, UserVideo, Question, Feedback
+    Video, Channel, UserVideo, WordSetVideoScore, Question, Feedback
 )
 from rest_framework import serializers
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -123,6 +123,13 @@ class UserVideoSerializer(serializers.ModelSerializer):
         model = UserVideo
         fields = ['video', 'score']
 
+class WordSetVideoScoreSerializer(serializers.ModelSerializer):
+    video = VideoSerializer(read_only=True)
+
+    class Meta:
+        model = WordSetVideoScore
+        fields = ['video', 'score']
+
 class QuestionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Question
@@ -1,3 +1,456 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from .models import (
+    Language, Word, WordInstance, UserWord, UserVideo, Video, Channel, UserPreferences,
+    WordSetVideoScore, Sentence, Definition, Translation, VideoWordCount
+)
+from .bulkload import bulk_insert
+from .definitions import fill_definitions, claim_word_ids, release_word_ids
+from .lexicon import invalidate_word_index
+from .scoring import invalidate_score_matrix, rebuild_video_word_counts, get_score_matrix
+from .tasks import calculate_user_video_scores
+from .transcripts import TranscriptFetcher, DirectoryTranscriptFetcher, TranscriptUnavailable
+from .translators import Translator, StubTranslator, GoogleBatchTranslator, get_translator
+from .utils import rebuild_word_instance_counts, generate_video_match_list
 
-# Create your tests here.
+class LexiconTestCase(TestCase):
+    """
+    A small Polish lexicon of root words with three derived forms each, and
+    videos with random word instances and their word counts.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1)
+        cls.language = Language.objects.create(name='Polish', abb='pl')
+        cls.channel = Channel.objects.create(url='channel', name='channel')
+        cls.roots = [Word.objects.create(text=f'r{i}', language=cls.language, tag='subst:sg:nom') for i in range(20)]
+        cls.derived = {
+            root.id: [
+                Word.objects.create(text=f'{root.text}d{j}', language=cls.language, tag='subst:pl:gen', root=root)
+                for j in range(3)
+            ]
+            for root in cls.roots
+        }
+        cls.words = cls.roots + [word for forms in cls.derived.values() for word in forms]
+
+        cls.videos = [
+            Video.objects.create(url=f'v{i}', title='t', channel=cls.channel, language=cls.language)
+            for i in range(8)
+        ]
+        for video in cls.videos:
+            WordInstance.objects.bulk_create([
+                WordInstance(word=rng.choice(cls.words), video=video, start=k, end=k + 1)
+                for k in range(rng.randint(5, 60))
+            ])
+        # A video without instances scores 0
+        cls.videos.append(Video.objects.create(url='empty', title='t', channel=cls.channel, language=cls.language))
+        rebuild_video_word_counts([video.id for video in cls.videos])
+
+    def setUp(self):
+        # Process-wide indexes are keyed on ids, which rolled back tests reuse
+        invalidate_word_index()
+        invalidate_score_matrix()
+        cache.clear()
+
+def count_video_scores(word_ids):
+    # Scores the way they were computed before the score matrix: one COUNT
+    # per video over its instances of the known words and their derived forms
+    matched_ids = set(word_ids) | set(Word.objects.filter(root_id__in=word_ids).values_list('id', flat=True))
+    scores = {}
+    for video in Video.objects.all():
+        instances = WordInstance.objects.filter(video=video)
+        total = instances.count()
+        scores[video.id] = 0 if total == 0 else round(instances.filter(word_id__in=matched_ids).count() / total * 100)
+    return scores
+
+@override_settings(VIDEO_SCORES_READ_THROUGH=False)
+class CalculateUserVideoScoresTests(LexiconTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='learner')
+        UserPreferences.objects.create(user=self.user, language=self.language)
+
+    def rescore(self):
+        calculate_user_video_scores.now(self.user.id, self.language.id)
+        word_ids = set(UserWord.objects.filter(user=self.user).values_list('word_id', flat=True))
+        expected = count_video_scores(word_ids)
+
+        word_set = UserPreferences.objects.get(user=self.user).word_set
+        self.assertEqual(
+            dict(WordSetVideoScore.objects.filter(word_set=word_set).values_list('video_id', 'score')),
+            expected
+        )
+        self.assertEqual(
+            dict(UserVideo.objects.filter(user=self.user).values_list('video_id', 'score')),
+            expected
+        )
+
+    def add(self, words):
+        UserWord.objects.bulk_create([UserWord(user=self.user, word=word) for word in words])
+
+    def remove(self, words):
+        UserWord.objects.filter(user=self.user, word__in=words).delete()
+
+    def test_add_and_remove_steps_match_per_video_counts(self):
+        roots = self.roots
+        # Derived forms whose root is not known, alone and next to a sibling
+        loose = [self.derived[roots[10].id][0], self.derived[roots[11].id][1], self.derived[roots[11].id][2]]
+
+        self.add(roots[:5] + loose[:1])
+        self.rescore()
+
+        # Every later step starts from the stored matched counts of the
+        # previous word set instead of scoring from scratch
+        with mock.patch('api.tasks.generate_video_match_list', wraps=generate_video_match_list) as full:
+            self.add(roots[5:8] + loose[1:])
+            self.rescore()
+
+            self.remove(roots[:2] + loose[:1])
+            self.rescore()
+
+            # Learning the root of a loose form covers the form through the root
+            self.add([roots[11]])
+            self.rescore()
+
+            self.remove([roots[11]])
+            self.rescore()
+
+            self.remove(loose[1:2])
+            self.add(roots[12:15])
+            self.rescore()
+
+        full.assert_not_called()
+
+    def test_returning_to_a_known_word_set_reuses_its_scores(self):
+        self.add(self.roots[:4])
+        self.rescore()
+        first_word_set = UserPreferences.objects.get(user=self.user).word_set
+
+        self.add(self.roots[4:6])
+        self.rescore()
+        self.remove(self.roots[4:6])
+        self.rescore()
+
+        self.assertEqual(UserPreferences.objects.get(user=self.user).word_set, first_word_set)
+
+class VideoWordCountBackfillTests(LexiconTestCase):
+    def setUp(self):
+        super().setUp()
+        # Videos imported before per-video word counts were kept
+        self.counts = sorted(VideoWordCount.objects.values_list('video_id', 'word_id', 'count'))
+        VideoWordCount.objects.all().delete()
+        Video.objects.update(instance_count=0)
+
+    def test_scoring_counts_videos_without_word_counts(self):
+        word_ids = {root.id for root in self.roots[:6]}
+        self.assertEqual(dict(get_score_matrix().score_list(word_ids)), count_video_scores(word_ids))
+        self.assertEqual(sorted(VideoWordCount.objects.values_list('video_id', 'word_id', 'count')), self.counts)
+
+    def test_video_words_counts_videos_without_word_counts(self):
+        response = APIClient().get(reverse('video-words', args=[self.videos[0].id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+
+class RebuildWordInstanceCountsTests(LexiconTestCase):
+    def expected_counts(self):
+        counts = {root.id: 0 for root in Word.objects.filter(root=None)}
+        for word_id, root_id in WordInstance.objects.values_list('word_id', 'word__root_id'):
+            counts[root_id or word_id] += 1
+        return counts
+
+    def actual_counts(self):
+        return dict(Word.objects.filter(root=None).values_list('id', 'instance_count'))
+
+    def test_counts_word_instances_without_video_word_counts(self):
+        VideoWordCount.objects.all().delete()
+        rebuild_word_instance_counts()
+        self.assertEqual(self.actual_counts(), self.expected_counts())
+        self.assertTrue(any(self.actual_counts().values()))
+
+    def test_counts_follow_a_lexicon_fix(self):
+        rebuild_word_instance_counts()
+        # A form moved to another root takes its instances along
+        moved = self.derived[self.roots[0].id][0]
+        Word.objects.filter(id=moved.id).update(root=self.roots[1])
+        rebuild_word_instance_counts()
+        self.assertEqual(self.actual_counts(), self.expected_counts())
+
+class BulkInsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.channel = Channel.objects.create(url='channel', name='channel')
+
+    def sentences_for_new_video(self, url):
+        # Built before their video is saved, as the importers do
+        video = Video(url=url, title='t', channel=self.channel)
+        sentences = [Sentence(video=video, text=f's{i}', start=i, end=i + 1) for i in range(3)]
+        video.save()
+        return video, sentences
+
+    def test_inserts_rows_with_or_without_copy(self):
+        for use_copy in (False, True):
+            with self.subTest(use_copy=use_copy):
+                video, sentences = self.sentences_for_new_video(f'v{use_copy}')
+                bulk_insert(Sentence, sentences, use_copy=use_copy)
+                self.assertEqual(
+                    list(Sentence.objects.filter(video=video).order_by('start').values_list('text', 'start', 'end')),
+                    [('s0', 0, 1), ('s1', 1, 2), ('s2', 2, 3)]
+                )
+
+    def test_copy_falls_back_to_bulk_create_off_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('COPY is used on PostgreSQL')
+        video, sentences = self.sentences_for_new_video('v')
+        with mock.patch('api.bulkload.copy_insert') as copy_insert:
+            bulk_insert(Sentence, sentences, use_copy=True)
+        copy_insert.assert_not_called()
+        self.assertEqual(Sentence.objects.filter(video=video).count(), 3)
+
+    def test_empty_insert_runs_no_query(self):
+        with self.assertNumQueries(0):
+            bulk_insert(Sentence, [], use_copy=True)
+
+class RecordingTranslator(StubTranslator):
+    def __init__(self, source, target='en', failing=()):
+        super().__init__(source, target)
+        self.failing = set(failing)
+        self.requested = []
+
+    def translate_batch(self, texts):
+        self.requested.extend(texts)
+        return [None if text in self.failing else translated
+                for text, translated in zip(texts, super().translate_batch(texts))]
+
+class GoogleBatchTranslatorTests(TestCase):
+    def test_page_of_words_is_spread_over_workers(self):
+        texts = [f'word{i}' for i in range(50)]
+        with mock.patch('api.translators.GoogleTranslator') as google:
+            google.return_value.translate.side_effect = lambda text: text.upper()
+            translated = GoogleBatchTranslator('pl', workers=4).translate_batch(texts)
+
+        self.assertEqual(translated, [text.upper() for text in texts])
+        # One client per chunk, one chunk per worker
+        self.assertEqual(google.call_count, 4)
+
+class FillDefinitionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.language = Language.objects.create(name='Polish', abb='pl')
+        cls.user = User.objects.create(username='learner')
+
+    def setUp(self):
+        cache.clear()
+
+    def word(self, text):
+        return Word.objects.create(text=text, language=self.language)
+
+    def global_definitions(self):
+        return dict(Definition.objects.filter(user=None).values_list('word_id', 'text'))
+
+    def test_configured_stub_backend(self):
+        with override_settings(TRANSLATOR_BACKEND='stub'):
+            translator = get_translator('pl')
+        self.assertIsInstance(translator, StubTranslator)
+        self.assertEqual(translator.translate_batch(['kot', 'pies']), ['[en] kot', '[en] pies'])
+
+    def test_incomplete_translator_fails_at_creation(self):
+        class NoBatch(Translator):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoBatch('pl')
+
+    def test_fills_each_spelling_once(self):
+        # Homographs and differently cased spellings share one translation
+        words = [self.word('Zamek'), self.word('zamek'), self.word('kot')]
+        translator = RecordingTranslator('pl')
+
+        filled = fill_definitions([word.id for word in words], 'pl', translator)
+
+        self.assertCountEqual(filled, [word.id for word in words])
+        self.assertCountEqual(translator.requested, ['zamek', 'kot'])
+        self.assertEqual(self.global_definitions(), {
+            words[0].id: '[en] zamek', words[1].id: '[en] zamek', words[2].id: '[en] kot'
+        })
+
+        # Later words with a known spelling come from the translation cache
+        again = self.word('ZAMEK')
+        fill_definitions([again.id], 'pl', translator)
+        self.assertCountEqual(translator.requested, ['zamek', 'kot'])
+        self.assertEqual(self.global_definitions()[again.id], '[en] zamek')
+
+    def test_keeps_filled_and_fills_placeholders(self):
+        filled, placeholder = self.word('dom'), self.word('las')
+        Definition.objects.create(word=filled, text='house')
+        Definition.objects.create(word=placeholder, text=None)
+        Definition.objects.create(word=placeholder, user=self.user, text='my forest')
+        translator = RecordingTranslator('pl')
+
+        fill_definitions([filled.id, placeholder.id], 'pl', translator)
+
+        self.assertEqual(translator.requested, ['las'])
+        self.assertEqual(self.global_definitions(), {filled.id: 'house', placeholder.id: '[en] las'})
+        self.assertEqual(Definition.objects.filter(user=None, word=placeholder).count(), 1)
+        self.assertEqual(Definition.objects.get(user=self.user).text, 'my forest')
+
+    def test_failed_translations_are_left_for_later(self):
+        ok, failed = self.word('kot'), self.word('pies')
+
+        filled = fill_definitions([ok.id, failed.id], 'pl', RecordingTranslator('pl', failing=['pies']))
+
+        self.assertEqual(filled, [ok.id])
+        self.assertEqual(self.global_definitions(), {ok.id: '[en] kot'})
+        self.assertFalse(Translation.objects.filter(text='pies').exists())
+
+        fill_definitions([ok.id, failed.id], 'pl', RecordingTranslator('pl'))
+        self.assertEqual(self.global_definitions()[failed.id], '[en] pies')
+
+@override_settings(VIDEO_SCORES_READ_THROUGH=False)
+class VideoCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.language = Language.objects.create(name='Polish', abb='pl')
+        other_language = Language.objects.create(name='German', abb='de')
+        channel = Channel.objects.create(url='channel', name='channel')
+        cls.videos = [
+            Video.objects.create(url=f'v{i}', title='t', channel=channel, language=cls.language)
+            for i in range(15)
+        ]
+        cls.other_video = Video.objects.create(url='other', title='t', channel=channel, language=other_language)
+
+        cls.user = User.objects.create(username='learner')
+        UserPreferences.objects.create(user=cls.user, language=cls.language)
+        # Few distinct scores, so pages break inside runs of equal scores
+        UserVideo.objects.bulk_create([
+            UserVideo(user=cls.user, video=video, score=(i % 3) * 10)
+            for i, video in enumerate(cls.videos[:11])
+        ])
+
+        cls.new_user = User.objects.create(username='newcomer')
+        UserPreferences.objects.create(user=cls.new_user, language=cls.language)
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def walk(self, client, **params):
+        """
+        Results of every page from the first one on, following next links.
+        """
+        pages = []
+        response = client.get(reverse('videos'), {'pagination': 'cursor', **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['previous'])
+            pages.append([(row['video']['id'], row['score']) for row in response.data['results']])
+            if response.data['next'] is None:
+                return pages
+            self.assertLess(len(pages), 50, 'Cursor pages never end')
+            response = client.get(response.data['next'])
+
+    def assertPages(self, pages, expected, page_size):
+        self.assertEqual([row for page in pages for row in page], expected)
+        self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+        self.assertTrue(0 < len(pages[-1]) <= page_size)
+
+    def test_scored_rows(self):
+        pages = self.walk(self.client_for(self.user), page_size=4)
+        expected = sorted(
+            UserVideo.objects.filter(user=self.user).values_list('video_id', 'score'),
+            key=lambda row: (-row[1], -row[0])
+        )
+        self.assertPages(pages, expected, 4)
+
+    def test_scored_rows_within_comprehension_range(self):
+        pages = self.walk(self.client_for(self.user), page_size=2, comprehension_min=10, comprehension_max=20)
+        expected = sorted(
+            UserVideo.objects.filter(user=self.user, score__gte=10).values_list('video_id', 'score'),
+            key=lambda row: (-row[1], -row[0])
+        )
+        self.assertPages(pages, expected, 2)
+
+    def test_fallback_rows(self):
+        pages = self.walk(self.client_for(self.new_user), page_size=4)
+        expected = [(video.id, 0) for video in sorted(self.videos, key=lambda video: -video.id)]
+        self.assertPages(pages, expected, 4)
+
+    def test_anonymous(self):
+        pages = self.walk(self.client_for(), page_size=5)
+        expected = [(video.id, 0) for video in sorted(self.videos + [self.other_video], key=lambda video: -video.id)]
+        self.assertPages(pages, expected, 5)
+
+    def test_malformed_cursor(self):
+        client = self.client_for(self.user)
+        for cursor in ['x:1', 's:abc', 's:10', 's:10:1:2', 'v:', '10']:
+            with self.subTest(cursor=cursor):
+                response = client.get(reverse('videos'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_scored_cursor_without_scored_rows(self):
+        # Scores gone since the previous page leave an empty last page
+        response = self.client_for(self.new_user).get(reverse('videos'), {'cursor': 's:10:1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['next'])
+
+        # Anonymous pages are never scored
+        response = self.client_for().get(reverse('videos'), {'cursor': 's:10:1'})
+        self.assertEqual(response.status_code, 400)
+
+class ClaimWordIdsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_claims_are_disjoint(self):
+        word_ids = list(range(1, 201))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            claims = list(executor.map(lambda _: claim_word_ids(word_ids), range(8)))
+
+        claimed = [word_id for claim in claims for word_id in claim]
+        self.assertCountEqual(claimed, word_ids)
+
+    def test_released_words_can_be_claimed_again(self):
+        self.assertEqual(claim_word_ids([1, 2, 3]), [1, 2, 3])
+        self.assertEqual(claim_word_ids([2, 3, 4]), [4])
+        release_word_ids([2])
+        self.assertEqual(claim_word_ids([1, 2]), [2])
+
+class TranscriptFetcherTests(TestCase):
+    def test_incomplete_fetcher_fails_at_creation(self):
+        class NoFetch(TranscriptFetcher):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoFetch()
+
+    def test_directory_fetcher(self):
+        segments = [{'text': 'dzień dobry', 'start': 0.0, 'duration': 1.5}]
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'plain.json'), 'w', encoding='utf-8') as f:
+                json.dump(segments, f)
+            with open(os.path.join(directory, 'titled.json'), 'w', encoding='utf-8') as f:
+                json.dump({'title': 'Title', 'transcript': segments}, f)
+            with open(os.path.join(directory, 'broken.json'), 'w', encoding='utf-8') as f:
+                f.write('{')
+            fetcher = DirectoryTranscriptFetcher(directory)
+
+            self.assertEqual(fetcher.video_ids(), ['broken', 'plain', 'titled'])
+            self.assertEqual(fetcher.load('plain'), {'title': 'plain', 'transcript': segments})
+            self.assertEqual(fetcher.load('titled')['title'], 'Title')
+            self.assertEqual(fetcher.fetch('titled', 'pl'), segments)
+            for video_id in ('broken', 'missing'):
+                with self.assertRaises(TranscriptUnavailable):
+                    fetcher.fetch(video_id, 'pl')
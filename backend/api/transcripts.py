@@ -0,0 +1,106 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from youtube_transcript_api import (
+    YouTubeTranscriptApi, CouldNotRetrieveTranscript, TranscriptsDisabled,
+    NoTranscriptFound, VideoUnavailable, InvalidVideoId, AgeRestricted
+)
+
+class TranscriptUnavailable(Exception):
+    pass
+
+class TranscriptFetcher(ABC):
+    """
+    Source of video transcripts. fetch returns a list of segment dicts with
+    'text', 'start' and 'duration' keys, or raises TranscriptUnavailable.
+    """
+
+    @abstractmethod
+    def fetch(self, video_id, language):
+        pass
+
+class YouTubeTranscriptFetcher(TranscriptFetcher):
+    # Errors that will not go away by asking again
+    PERMANENT_ERRORS = (
+        TranscriptsDisabled, NoTranscriptFound, VideoUnavailable, InvalidVideoId, AgeRestricted
+    )
+
+    def __init__(self, retries=3, backoff=1.0):
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(self, video_id, language):
+        for attempt in range(self.retries + 1):
+            try:
+                return YouTubeTranscriptApi.get_transcript(video_id, languages=[language])
+            except self.PERMANENT_ERRORS as e:
+                raise TranscriptUnavailable(str(e)) from e
+            except (CouldNotRetrieveTranscript, OSError) as e:
+                if attempt == self.retries:
+                    raise TranscriptUnavailable(str(e)) from e
+                time.sleep(self.backoff * 2 ** attempt)
+
+class DirectoryTranscriptFetcher(TranscriptFetcher):
+    """
+    Reads transcripts from <directory>/<video_id>.json, holding either the
+    list of segments or an object with 'title' and 'transcript' keys.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.json")
+
+    def load(self, video_id):
+        try:
+            with open(self.path(video_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise TranscriptUnavailable(str(e)) from e
+        if isinstance(data, list):
+            return {'title': video_id, 'transcript': data}
+        return data
+
+    def fetch(self, video_id, language):
+        return self.load(video_id)['transcript']
+
+    def video_ids(self):
+        return sorted(
+            name[:-len('.json')] for name in os.listdir(self.directory)
+            if name.endswith('.json')
+        )
+
+def fetch_transcripts(fetcher, videos, language, workers=8):
+    """
+    Fetch transcripts for (video_id, context) pairs on a bounded thread pool
+    and yield (video_id, context, transcript) as each one completes, with
+    transcript None when it is unavailable. At most 2 * workers fetches are
+    queued at a time, so the caller's tagging and database work overlaps with
+    the network instead of waiting for the whole channel.
+    """
+    videos = iter(videos)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def fill():
+            while len(pending) < 2 * workers:
+                try:
+                    video_id, context = next(videos)
+                except StopIteration:
+                    return
+                pending[executor.submit(fetcher.fetch, video_id, language)] = (video_id, context)
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                video_id, context = pending.pop(future)
+                try:
+                    transcript = future.result()
+                except TranscriptUnavailable:
+                    transcript = None
+                yield video_id, context, transcript
+            fill()
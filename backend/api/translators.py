@@ -0,0 +1,75 @@
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from django.conf import settings
+from deep_translator import GoogleTranslator
+from deep_translator.exceptions import TranslationNotFound, RequestError, TooManyRequests
+
+class Translator(ABC):
+    """
+    Translates batches of words. translate_batch returns one result per text,
+    in order: the translation, "" when there is none, or None when the text
+    could not be translated right now and should be tried again later.
+    """
+
+    def __init__(self, source, target='en'):
+        self.source = source
+        self.target = target
+
+    @abstractmethod
+    def translate_batch(self, texts):
+        pass
+
+class GoogleBatchTranslator(Translator):
+    # Errors that may go away by asking again
+    TRANSIENT_ERRORS = (RequestError, TooManyRequests, OSError)
+
+    def __init__(self, source, target='en', chunk_size=50, workers=4, retries=3, backoff=1.0):
+        super().__init__(source, target)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+    def translate_batch(self, texts):
+        texts = list(texts)
+        # Spread even a single page of words over every worker; chunk_size
+        # only caps how much one worker takes at a time
+        size = max(1, min(self.chunk_size, ceil(len(texts) / self.workers)))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        if len(chunks) <= 1:
+            return [text for chunk in chunks for text in self.translate_chunk(chunk)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return [text for chunk in executor.map(self.translate_chunk, chunks) for text in chunk]
+
+    def translate_chunk(self, texts):
+        # The web endpoint takes one text per request and a GoogleTranslator
+        # keeps per-request state, so every chunk gets its own instance
+        translator = GoogleTranslator(source=self.source, target=self.target)
+        return [self.translate_text(translator, text) for text in texts]
+
+    def translate_text(self, translator, text):
+        for attempt in range(self.retries + 1):
+            try:
+                return translator.translate(text=text) or ""
+            except TranslationNotFound:
+                return ""
+            except self.TRANSIENT_ERRORS:
+                if attempt == self.retries:
+                    return None
+                time.sleep(self.backoff * 2 ** attempt)
+
+class StubTranslator(Translator):
+    """
+    Offline translator for tests and benchmarks that tags each text with the
+    target language instead of translating it.
+    """
+
+    def translate_batch(self, texts):
+        return [f"[{self.target}] {text}" for text in texts]
+
+def get_translator(source, target='en', workers=None):
+    if settings.TRANSLATOR_BACKEND == 'stub':
+        return StubTranslator(source, target)
+    return GoogleBatchTranslator(source, target, workers=workers or settings.TRANSLATOR_WORKERS)
@@ -1,12 +1,19 @@
 from .models import (
-    Language, Word, WordInstance, UserWord, UserVideo, Video, 
+    Language, Word, WordInstance, UserWord, UserVideo, Video, VideoWordCount, UserPreferences,
     Question, Sentence, Feedback, WordSet, WordSetVideoScore, Unaccent
 )
-from django.db.models import Q
+from django.db.models import Q, F, Count, Min, Max
 from django.db.models.functions import Lower
-from django.db import transaction
+from django.db import transaction, connection
+from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils.timezone import now
+from datetime import timedelta
 from openai import OpenAI
+from .scoring import get_score_matrix
+from .lexicon import resolve_root_ids
+from collections import defaultdict
+import numpy as np
 import hashlib
 
 def get_common_words(language, exclude_ids=None, count=1000):
@@ -17,7 +24,7 @@ def get_common_words(language, exclude_ids=None, count=1000):
         Word.objects
         .filter(language=language, root=None, instance_count__gt=0)
         .exclude(id__in=exclude_ids)
-        .order_by('-instance_count')[:count]
+        .order_by('-instance_count', 'id')[:count]
     )
     return words
 
@@ -40,8 +47,14 @@ def get_search_words(language, exclude_ids=None, term=''):
     results = []
     seen_ids = set(exclude_ids)
 
-    for word in qs:
-        base_word = word.root if word.root else word
+    words = list(qs)
+    root_ids = resolve_root_ids([word.id for word in words]).tolist()
+    root_words = Word.objects.in_bulk(
+        [root_id for word, root_id in zip(words, root_ids) if root_id not in (word.id, -1)]
+    )
+
+    for word, root_id in zip(words, root_ids):
+        base_word = root_words.get(root_id, word)
         if base_word.id in seen_ids:
             continue
         results.append(base_word)
@@ -70,7 +83,7 @@ def get_video_scores_for_wordset(word_ids: set) -> list[tuple[int, int]]:
         .values_list('video_id', 'score')
     )
 
-def store_wordset_video_scores(word_ids: set, video_scores: list[tuple[int, int]]):
+def store_wordset_video_scores(word_ids: set, video_scores: list[tuple[int, int, int]]):
     if not word_ids or not video_scores:
         raise ValueError("Both word_ids and video_score_list must be non-empty.")
 
@@ -92,8 +105,8 @@ def store_wordset_video_scores(word_ids: set, video_scores: list[tuple[int, int]
         )
 
         to_create = [
-            WordSetVideoScore(word_set=word_set, video_id=vid, score=score)
-            for vid, score in video_scores if vid not in existing_video_ids
+            WordSetVideoScore(word_set=word_set, video_id=vid, score=score, matched_count=matched)
+            for vid, score, matched in video_scores if vid not in existing_video_ids
         ]
 
         if to_create:
@@ -101,29 +114,148 @@ def store_wordset_video_scores(word_ids: set, video_scores: list[tuple[int, int]
         
         return word_set
 
-def generate_video_score_list(word_ids):
-    # Get all words whose root is in the target set
-    related_root_word_ids = set(
-        Word.objects.filter(root_id__in=word_ids).values_list('id', flat=True)
+def fill_missing_wordset_scores(word_set, word_ids):
+    # Score videos imported while the word set was not referenced by any user
+    scored_video_ids = WordSetVideoScore.objects.filter(word_set=word_set).values('video_id')
+    missing_video_ids = list(
+        Video.objects.exclude(id__in=scored_video_ids).values_list('id', flat=True)
     )
+    if not missing_video_ids:
+        return
 
-    all_matched_ids = word_ids | related_root_word_ids
+    video_scores = get_score_matrix().matched_list(word_ids, missing_video_ids)
+    WordSetVideoScore.objects.bulk_create([
+        WordSetVideoScore(word_set=word_set, video_id=vid, score=score, matched_count=matched)
+        for vid, score, matched in video_scores
+    ], batch_size=1000, ignore_conflicts=True)
+
+def evict_word_sets(max_count=None, ttl_days=None):
+    """
+    Delete word sets no user references: those unused for ttl_days, then the
+    least recently used ones until at most max_count sets remain. Returns the
+    number of word sets deleted.
+    """
+    if max_count is None:
+        max_count = settings.WORDSET_MAX_COUNT
+    if ttl_days is None:
+        ttl_days = settings.WORDSET_UNREFERENCED_TTL_DAYS
+
+    unreferenced = WordSet.objects.filter(userpreferences__isnull=True)
+
+    expired_ids = list(
+        unreferenced
+        .filter(last_used_at__lt=now() - timedelta(days=ttl_days))
+        .values_list('id', flat=True)
+    )
 
-    video_scores = []
+    excess = WordSet.objects.count() - len(expired_ids) - max_count
+    lru_ids = []
+    if excess > 0:
+        lru_ids = list(
+            unreferenced
+            .exclude(id__in=expired_ids)
+            .order_by('last_used_at')
+            .values_list('id', flat=True)[:excess]
+        )
 
-    for video in Video.objects.all():
-        word_instances = WordInstance.objects.filter(video=video)
+    evicted = 0
+    ids = expired_ids + lru_ids
+    for i in range(0, len(ids), 500):
+        # Re-check references in case a user picked the set up meanwhile
+        with transaction.atomic():
+            _, deleted = unreferenced.filter(id__in=ids[i:i + 500]).delete()
+        evicted += deleted.get('api.WordSet', 0)
+    return evicted
 
-        total_instances = word_instances.count()
-        if total_instances == 0:
-            score = 0
-        else:
-            matched_count = word_instances.filter(word_id__in=all_matched_ids).count()
-            score = round((matched_count / total_instances) * 100)
+def generate_video_score_list(word_ids):
+    # Score every video against the word set (and words derived from it)
+    # with a single sparse matrix-vector product
+    return get_score_matrix().score_list(word_ids)
 
-        video_scores.append((video.id, score))
+def generate_video_match_list(word_ids):
+    return get_score_matrix().matched_list(word_ids)
 
-    return video_scores
+def generate_incremental_video_match_list(previous_word_set, word_ids):
+    # Start from the matched counts stored for the previous word set and only
+    # apply the words that were added or removed since
+    previous_matched = dict(
+        WordSetVideoScore.objects
+        .filter(word_set=previous_word_set)
+        .values_list('video_id', 'matched_count')
+    )
+    if not previous_matched or None in previous_matched.values():
+        return generate_video_match_list(word_ids)
+
+    previous_word_ids = set(previous_word_set.words.values_list('id', flat=True))
+    return get_score_matrix().incremental_matched_list(previous_word_ids, word_ids, previous_matched)
+
+def build_video_word_counts(word_instances):
+    """
+    Build VideoWordCount rows (one per root word per video) for unsaved
+    WordInstance objects and set instance_count on their videos.
+    """
+    videos = {}
+    counts = defaultdict(int)
+    root_ids = resolve_root_ids([instance.word_id for instance in word_instances]).tolist()
+    for instance, root_id in zip(word_instances, root_ids):
+        video = instance.video
+        videos[id(video)] = video
+        counts[(id(video), root_id)] += 1
+
+    for video in videos.values():
+        video.instance_count = 0
+
+    word_counts = []
+    for (video_key, word_id), count in counts.items():
+        video = videos[video_key]
+        video.instance_count += count
+        word_counts.append(VideoWordCount(video=video, word_id=word_id, count=count))
+    return word_counts
+
+def increment_word_instance_counts(word_counts, chunk_size=1000):
+    """
+    Add the counts of newly inserted VideoWordCount rows to instance_count of
+    their root words, one UPDATE per distinct increment and chunk of words.
+    """
+    deltas = defaultdict(int)
+    for word_count in word_counts:
+        deltas[word_count.word_id] += word_count.count
+
+    words_by_delta = defaultdict(list)
+    for word_id, delta in deltas.items():
+        words_by_delta[delta].append(word_id)
+
+    for delta, word_ids in words_by_delta.items():
+        for i in range(0, len(word_ids), chunk_size):
+            Word.objects.filter(id__in=word_ids[i:i + chunk_size]).update(
+                instance_count=F('instance_count') + delta
+            )
+
+def rebuild_word_instance_counts():
+    """
+    Recompute instance_count of every root word from WordInstance (its own
+    instances and those of its derived words) in one statement. Returns the
+    number of words whose count changed.
+    """
+    word_table = Word._meta.db_table
+    sql = f"""
+        UPDATE {word_table} SET instance_count = c.total
+        FROM (
+            SELECT r.id AS word_id, COALESCE(i.total, 0) AS total
+            FROM {word_table} r
+            LEFT JOIN (
+                SELECT COALESCE(w.root_id, w.id) AS root_id, COUNT(*) AS total
+                FROM {WordInstance._meta.db_table} wi
+                JOIN {word_table} w ON w.id = wi.word_id
+                GROUP BY COALESCE(w.root_id, w.id)
+            ) i ON i.root_id = r.id
+            WHERE r.root_id IS NULL
+        ) c
+        WHERE {word_table}.id = c.word_id AND {word_table}.instance_count <> c.total
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.rowcount
 
 def populate_user_video_scores(user_id, language_id, word_set):
     # Get all videos filtered by language
@@ -164,6 +296,120 @@ def populate_user_video_scores(user_id, language_id, word_set):
         if to_update:
             UserVideo.objects.bulk_update(to_update, ['score'], batch_size=500)
 
+def user_id_ranges(chunk_size):
+    # Contiguous (min, max) user id ranges covering every user
+    bounds = User.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+    if bounds['min_id'] is None:
+        return []
+    return [
+        (start, min(start + chunk_size - 1, bounds['max_id']))
+        for start in range(bounds['min_id'], bounds['max_id'] + 1, chunk_size)
+    ]
+
+def propagate_video_scores(video_ids, min_user_id, max_user_id):
+    """
+    Upsert UserVideo scores for the given videos from the current word set of
+    every user with an id in [min_user_id, max_user_id], in one statement.
+    Returns the number of rows written.
+    """
+    video_ids = list(video_ids)
+    if not video_ids:
+        return 0
+
+    user_video_table = UserVideo._meta.db_table
+    placeholders = ", ".join(["%s"] * len(video_ids))
+    sql = f"""
+        INSERT INTO {user_video_table} (user_id, video_id, score)
+        SELECT p.user_id, s.video_id, s.score
+        FROM {UserPreferences._meta.db_table} p
+        JOIN {WordSetVideoScore._meta.db_table} s ON s.word_set_id = p.word_set_id
+        WHERE p.user_id BETWEEN %s AND %s AND s.video_id IN ({placeholders})
+        ON CONFLICT (user_id, video_id)
+        DO UPDATE SET score = EXCLUDED.score
+        WHERE {user_video_table}.score <> EXCLUDED.score
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [min_user_id, max_user_id, *video_ids])
+        return cursor.rowcount
+
+def recompute_user_video_scores(user_ids, chunk_size=200):
+    """
+    Rescore every video in each user's language for the given users, one
+    vectorized pass per chunk of users, and upsert the results into
+    UserVideo. Returns the number of rows written.
+    """
+    matrix = get_score_matrix()
+    video_languages = dict(Video.objects.values_list('id', 'language_id'))
+    languages = np.array([video_languages.get(vid) or -1 for vid in matrix.video_ids.tolist()])
+
+    user_ids = sorted(user_ids)
+    written = 0
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        user_languages = dict(
+            UserPreferences.objects.filter(user_id__in=chunk).values_list('user_id', 'language_id')
+        )
+        vocabularies = defaultdict(set)
+        for user_id, word_id in UserWord.objects.filter(user_id__in=chunk).values_list('user_id', 'word_id'):
+            vocabularies[user_id].add(word_id)
+
+        chunk = [user_id for user_id in chunk if vocabularies[user_id] and user_id in user_languages]
+        if not chunk:
+            continue
+        scores = matrix.scores(matrix.batch_matched_counts([vocabularies[user_id] for user_id in chunk]))
+
+        user_videos = []
+        for row, user_id in enumerate(chunk):
+            for col in np.flatnonzero(languages == (user_languages[user_id] or -1)):
+                user_videos.append(UserVideo(
+                    user_id=user_id, video_id=int(matrix.video_ids[col]), score=int(scores[row, col])
+                ))
+
+        with transaction.atomic():
+            UserVideo.objects.bulk_create(
+                user_videos, batch_size=2000, update_conflicts=True,
+                unique_fields=['user', 'video'], update_fields=['score']
+            )
+        written += len(user_videos)
+    return written
+
+def recompute_word_set_scores(word_set_ids, chunk_size=200):
+    """
+    Rescore every video for the given word sets, one vectorized pass per
+    chunk of word sets, and upsert the results into WordSetVideoScore.
+    Returns the number of rows written.
+    """
+    matrix = get_score_matrix()
+
+    word_set_ids = sorted(word_set_ids)
+    written = 0
+    for i in range(0, len(word_set_ids), chunk_size):
+        chunk = word_set_ids[i:i + chunk_size]
+        vocabularies = defaultdict(set)
+        memberships = WordSet.words.through.objects.filter(wordset_id__in=chunk).values_list('wordset_id', 'word_id')
+        for word_set_id, word_id in memberships:
+            vocabularies[word_set_id].add(word_id)
+
+        matched = matrix.batch_matched_counts([vocabularies[word_set_id] for word_set_id in chunk])
+        scores = matrix.scores(matched)
+
+        video_scores = [
+            WordSetVideoScore(
+                word_set_id=word_set_id, video_id=int(video_id),
+                score=int(scores[row, col]), matched_count=int(matched[row, col])
+            )
+            for row, word_set_id in enumerate(chunk)
+            for col, video_id in enumerate(matrix.video_ids)
+        ]
+
+        with transaction.atomic():
+            WordSetVideoScore.objects.bulk_create(
+                video_scores, batch_size=2000, update_conflicts=True,
+                unique_fields=['word_set', 'video'], update_fields=['score', 'matched_count']
+            )
+        written += len(video_scores)
+    return written
+
 def generate_question(sentences, language):
     question_count = Question.objects.count()
     if question_count > 500:
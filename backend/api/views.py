@@ -3,26 +3,31 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
 from django.utils.timezone import now
 from django.db.models import Q, Count
-from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from fsrs import Scheduler, Rating
 from .models import (
     UserPreferences, Language, Word, UserWord, WordInstance, Definition, Video,
-    UserVideo, Sentence, Question, Answer
+    UserVideo, VideoWordCount, WordSetVideoScore, Sentence, Question, Answer
 )
 from .serializers import (
     UserSerializer, UserPreferencesSerializer, UserLoginSerializer, 
     UserSignupSerializer, UserWordSerializer, WordSerializer, 
     DefinitionSerializer, VideoSerializer, UserVideoSerializer,
-    QuestionSerializer, LanguageSerializer
+    WordSetVideoScoreSerializer, QuestionSerializer, LanguageSerializer
 )
 from .utils import (
     get_common_words, create_questions, generate_feedback, get_conjugation_table, get_search_words
 )
+from .lexicon import get_word_index, resolve_root_ids
+from .scoring import ensure_video_word_counts
+from .definitions import resolve_definitions
 from .tasks import (
-    add_definitions, calculate_user_video_scores
+    queue_definitions, queue_user_video_scores
 )
 
 @api_view(['GET'])
@@ -89,9 +94,9 @@ def add_words(user, words):
     UserWord.objects.bulk_create(new_userwords)
 
     if new_words:
-        calculate_user_video_scores(user.id, words[0].language.id)
+        queue_user_video_scores(user.id, words[0].language.id)
         word_ids = [word.id for word in new_words]
-        add_definitions(word_ids, words[0].language.abb)
+        queue_definitions(word_ids, words[0].language.abb)
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
@@ -128,7 +133,7 @@ def user_words_del(request):
 
     # Delete UserWord entries for current user and matching word IDs
     deleted, _ = UserWord.objects.filter(user=user, word_id__in=word_ids).delete()
-    calculate_user_video_scores(user.id, language_id)
+    queue_user_video_scores(user.id, language_id)
 
     return Response({'deleted': deleted}, status=status.HTTP_200_OK)
 
@@ -158,7 +163,7 @@ def words_learn(request):
     result_page = paginator.paginate_queryset(words, request)
 
     word_ids = [word.id for word in result_page]
-    add_definitions(word_ids, language.abb)
+    queue_definitions(word_ids, language.abb)
     serializer = WordSerializer(result_page, many=True)
 
     return paginator.get_paginated_response(serializer.data)
@@ -182,18 +187,8 @@ def get_user_reviews(request):
     # Collect word_ids for filtering definitions
     word_ids = [word['word_id'] for word in words_data]
 
-    # Query user-specific and fallback definitions
-    definition_queryset = Definition.objects.filter(
-        Q(user=user) | Q(user=None),
-        word_id__in=word_ids
-    )
-
-    # Pick one definition per word, preferring user-specific
-    definitions_dict = {}
-    for definition in definition_queryset:
-        # Only override if there's no user-specific one already stored
-        if definition.word_id not in definitions_dict or definition.user == user:
-            definitions_dict[definition.word_id] = definition.text
+    # The user's own definitions, falling back to the cached global ones
+    definitions_dict = resolve_definitions(user, word_ids)
 
     # Add definition to each word
     for word in words_data:
@@ -233,20 +228,10 @@ def definitions(request, word_id):
     except Word.DoesNotExist:
         return Response({"error": "Word not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    user = request.user if request.user.is_authenticated else None
-
-    # Prefer user's definition
-    definition = Definition.objects.filter(user=user, word=word).first()
-
-    # If user's doesn't exist, fall back to global definition
-    if not definition:
-        definition = Definition.objects.filter(user=None, word=word).first()
-
     if request.method == 'GET':
-        if not definition:
-            return Response({"text": ""})
-        serializer = DefinitionSerializer(definition)
-        return Response(serializer.data)
+        # Prefer user's definition, else the global one
+        text = resolve_definitions(request.user, [word.id]).get(word.id)
+        return Response({"word": word.id, "text": text or ""})
 
     elif request.method == 'PATCH':
         if not request.user.is_authenticated:
@@ -266,9 +251,80 @@ class MyVideosPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class VideoCursorPagination:
+    """
+    Keyset pagination for get_videos. Rows are ordered by descending key
+    fields and the cursor holds the key of the last row served, so every
+    page is an index range scan with no COUNT or OFFSET. Scored rows are
+    keyed on (score, video_id) and fallback videos on id; the cursor's
+    prefix says which.
+    """
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    kinds = {'s': ('score', 'video_id'), 'v': ('id',)}
+
+    def __init__(self, request):
+        self.request = request
+        self.kind = None
+        self.position = None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            kind, _, values = cursor.partition(':')
+            if kind not in self.kinds:
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+            try:
+                self.position = [int(value) for value in values.split(':')]
+            except ValueError:
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+            if len(self.position) != len(self.kinds[kind]):
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+            self.kind = kind
+
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        self.page_size = max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, kind):
+        fields = self.kinds[kind]
+        if self.kind == kind:
+            # Rows strictly after the cursor in descending key order
+            after = Q()
+            equal = {}
+            for field, value in zip(fields, self.position):
+                after |= Q(**equal, **{f'{field}__lt': value})
+                equal[field] = value
+            queryset = queryset.filter(after)
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset.order_by(*[f'-{field}' for field in fields])[:self.page_size + 1])
+        self.next_position = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last = rows[-1]
+            self.next_position = ':'.join([kind] + [str(getattr(last, field)) for field in fields])
+        return rows
+
+    def get_paginated_response(self, data):
+        next_link = None
+        if self.next_position:
+            next_link = replace_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param, self.next_position
+            )
+        return Response({'next': next_link, 'previous': None, 'results': data})
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
 def get_videos(request):
+    # ?pagination=cursor (or a cursor from a previous page) switches to
+    # keyset pages; page numbers stay the default
+    if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+        cursor_paginator = VideoCursorPagination(request)
+    else:
+        cursor_paginator = None
     paginator = MyVideosPagination()
 
     if request.user.is_authenticated:
@@ -284,16 +340,30 @@ def get_videos(request):
         except ValueError:
             return Response({'detail': 'Invalid comprehension values.'}, status=400)
 
-        user_videos = UserVideo.objects.filter(
-            user=request.user,
+        if settings.VIDEO_SCORES_READ_THROUGH:
+            # Rank straight from the scores of the user's current word set
+            user_videos = WordSetVideoScore.objects.filter(word_set_id=prefs.word_set_id)
+            video_serializer_class = WordSetVideoScoreSerializer
+        else:
+            user_videos = UserVideo.objects.filter(user=request.user)
+            video_serializer_class = UserVideoSerializer
+
+        user_videos = user_videos.filter(
             video__language=prefs.language,
             score__gte=comprehension_min,
             score__lte=comprehension_max
-        ).select_related('video', 'video__channel', 'video__language').order_by('-score')
-
-        if user_videos.exists():
-            page = paginator.paginate_queryset(user_videos, request)
-            serializer = UserVideoSerializer(page, many=True)
+        ).select_related('video', 'video__channel', 'video__language')
+
+        if cursor_paginator is not None:
+            # A fallback cursor means the scored rows already came up empty
+            if cursor_paginator.kind != 'v':
+                page = cursor_paginator.paginate_queryset(user_videos, 's')
+                if page or cursor_paginator.kind == 's':
+                    serializer = video_serializer_class(page, many=True)
+                    return cursor_paginator.get_paginated_response(serializer.data)
+        elif user_videos.exists():
+            page = paginator.paginate_queryset(user_videos.order_by('-score', '-video_id'), request)
+            serializer = video_serializer_class(page, many=True)
             return paginator.get_paginated_response(serializer.data)
 
         # Fallback: no UserVideo rows, use default videos with score 0
@@ -307,7 +377,13 @@ def get_videos(request):
             .order_by('-id')  # fallback ordering can be any
 
     # Paginate fallback videos
-    page = paginator.paginate_queryset(fallback_videos, request)
+    if cursor_paginator is not None:
+        if cursor_paginator.kind == 's':
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+        page = cursor_paginator.paginate_queryset(fallback_videos, 'v')
+        paginator = cursor_paginator
+    else:
+        page = paginator.paginate_queryset(fallback_videos, request)
     serialized_page = [
         {
             'video': VideoSerializer(video).data,
@@ -325,37 +401,23 @@ def video_words(request, video_id):
     except Video.DoesNotExist:
         return Response({'error': 'Video not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    word_instances = (
-        WordInstance.objects
-        .filter(video=video)
-        .select_related('word__root')
-        .annotate(root_word_id=Coalesce('word__root_id', 'word_id'))
-    )
+    ensure_video_word_counts()
+    word_counts = VideoWordCount.objects.filter(video=video)
 
     # Exclude known root words for authenticated users
     if request.user.is_authenticated:
-        known_word_ids = (
-            UserWord.objects
-            .filter(user=request.user)
-            .select_related('word__root')
-            .annotate(root_id=Coalesce('word__root_id', 'word_id'))
-            .values_list('root_id', flat=True)
-        )
-        word_instances = word_instances.exclude(
-            word__root_id__in=known_word_ids
-        ).exclude(
-            word_id__in=known_word_ids
-        )
+        user_word_ids = UserWord.objects.filter(user=request.user).values_list('word_id', flat=True)
+        known_word_ids = set(resolve_root_ids(user_word_ids).tolist())
+        word_counts = word_counts.exclude(word_id__in=known_word_ids)
 
-    # Count frequencies of root words
+    # Most frequent root words
     root_counts = (
-        word_instances
-        .values('root_word_id')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:word_count]
+        word_counts
+        .order_by('-count')
+        .values('word_id')[:word_count]
     )
 
-    root_word_ids = [entry['root_word_id'] for entry in root_counts]
+    root_word_ids = [entry['word_id'] for entry in root_counts]
 
     # Fetch and map words by ID
     words = Word.objects.filter(id__in=root_word_ids)
@@ -415,22 +477,31 @@ def conjugations(request, word_id):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def learn_word(request, word_id):
-    definition_obj = Definition.objects.filter(word_id=word_id, user=None).first()
-    definition_text = definition_obj.text if definition_obj and definition_obj.text else "No definition found"
+    definition_text = resolve_definitions(request.user, [word_id]).get(word_id) or "No definition found"
 
     # Get all relevant word IDs (including root and derived words)
-    derived_ids = list(Word.objects.filter(root_id=word_id).values_list('id', flat=True))
+    derived_ids = get_word_index().derived_of([word_id]).tolist()
     relevant_word_ids = [word_id] + derived_ids
 
-    # Find the video with the most WordInstances for relevant words
+    # Find the video with the most instances of the root word's family
+    ensure_video_word_counts()
     top_video_data = (
-        WordInstance.objects.filter(word_id__in=relevant_word_ids)
+        VideoWordCount.objects.filter(word_id=word_id)
+        .order_by('-count')
         .values('video')
-        .annotate(instance_count=Count('id'))
-        .order_by('-instance_count')
         .first()
     )
 
+    # Derived words have no counts of their own
+    if not top_video_data and not derived_ids:
+        top_video_data = (
+            WordInstance.objects.filter(word_id=word_id)
+            .values('video')
+            .annotate(instance_count=Count('id'))
+            .order_by('-instance_count')
+            .first()
+        )
+
     if not top_video_data:
         return Response({
             "definition": definition_text,
@@ -125,6 +125,37 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': False,
 }
 
+# Word set store
+# Word sets referenced by a user's preferences are never evicted. Unreferenced
+# sets are dropped once unused for the TTL, and least recently used ones are
+# dropped whenever the store holds more than the maximum number of sets.
+
+WORDSET_MAX_COUNT = int(os.getenv('WORDSET_MAX_COUNT', '5000'))
+WORDSET_UNREFERENCED_TTL_DAYS = int(os.getenv('WORDSET_UNREFERENCED_TTL_DAYS', '30'))
+
+# Rank videos straight from each user's word set scores instead of copying
+# them into one UserVideo row per video whenever the vocabulary changes.
+VIDEO_SCORES_READ_THROUGH = os.getenv('VIDEO_SCORES_READ_THROUGH') == 'True'
+
+# Delay before a queued vocabulary rescoring runs. Queuing another rescoring
+# for the same user within the window replaces the pending one.
+RESCORE_DEBOUNCE_SECONDS = int(os.getenv('RESCORE_DEBOUNCE_SECONDS', '10'))
+
+# Seconds between checks for lexicon changes by the in-process word root index.
+# New words are seen through the highest word id; other changes only through the
+# version key bumped by invalidate_word_index(), which lives in the Django cache
+# and so reaches other processes only with a shared CACHES backend (the default
+# local-memory cache is per process).
+WORD_INDEX_CHECK_SECONDS = int(os.getenv('WORD_INDEX_CHECK_SECONDS', '60'))
+
+# Load sentences and word instances with COPY instead of INSERT (PostgreSQL only)
+BULK_LOAD_COPY = os.getenv('BULK_LOAD_COPY', 'False') == 'True'
+
+# Translation backend for definitions ('google', or 'stub' to work offline)
+# and the number of concurrent translation requests
+TRANSLATOR_BACKEND = os.getenv('TRANSLATOR_BACKEND', 'google')
+TRANSLATOR_WORKERS = int(os.getenv('TRANSLATOR_WORKERS', '4'))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 